@@ -0,0 +1,12 @@
+"""benchmarks for xunitgen
+
+each module can be run on its own, from the root of the repository:
+
+    $ python -m benchmarks.pipeline        # every stage, with baselines
+    $ python -m benchmarks.parse_trace     # TT01 tokenizer vs. regex + eval
+    $ python -m benchmarks.parallel_parse  # scaling of --jobs
+    $ python -m benchmarks.binary_traces   # TT01 vs. TB01
+    $ python -m benchmarks.serialize       # direct serializer vs. ElementTree
+
+workloads come from benchmarks.generator and are deterministic.
+"""
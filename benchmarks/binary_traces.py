@@ -0,0 +1,50 @@
+"""compare reading the same traces from TT01 text and TB01 binary logs"""
+import os
+import shutil
+import time
+
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+
+from xunitgen.binary_traces import convert_tt01, iter_binary_traces
+from xunitgen.event_traces import parse_lines
+
+from .generator import generate_trace_lines
+
+
+def measure(traces):
+    start = time.perf_counter()
+    count = sum(1 for _ in traces)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=300000,
+                        help='approximate number of lines')
+    args = parser.parse_args()
+
+    root_dir = mkdtemp()
+    try:
+        text_path = os.path.join(root_dir, 'trace.log')
+        binary_path = os.path.join(root_dir, 'trace.tb')
+        with open(text_path, 'w') as outf:
+            outf.writelines(generate_trace_lines(args.lines // 2, failure_ratio=0.5))
+        with open(text_path) as file, open(binary_path, 'wb') as outf:
+            convert_tt01(parse_lines(file), outf)
+
+        with open(text_path) as file:
+            count, text_time = measure(parse_lines(file, text_path))
+        count, binary_time = measure(iter_binary_traces(binary_path))
+
+        print('TT01: %10d bytes %12.0f traces/s' % (
+            os.path.getsize(text_path), count / text_time))
+        print('TB01: %10d bytes %12.0f traces/s (x%.1f)' % (
+            os.path.getsize(binary_path), count / binary_time,
+            text_time / binary_time))
+    finally:
+        shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""deterministic synthetic workloads
+
+the same parameters and seed always produce the same traces and reports,
+so that measurements may be compared from one run to the next.
+"""
+import heapq
+import random
+
+from xunitgen import Report
+
+UNICODE_WORDS = [u'世界', u'café', u'über', u'λ', u'☃']
+
+
+def _text(rng, size, unicode):
+    letters = 'abcdefghijklmnopqrstuvwxyz "\\<>&'
+    text = ''.join(rng.choice(letters) for _ in range(size))
+    if unicode:
+        text += rng.choice(UNICODE_WORDS)
+    return text
+
+
+def _quote(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _worker_trace_lines(cases, tid, rng, failure_ratio, arg_size, unicode):
+    """(ts, line) pairs of a worker running the cases one after the other"""
+    ts = 44957283965 + rng.randint(0, 1000)
+    pid = 33366
+    for case in cases:
+        name = _quote('test_%d%s' % (case, u'_λ' if unicode else ''))
+        filename = _quote('src/tests/module_%d.c' % (case % 97))
+        yield ts, 'TT01 %d %d %d "test" %s "B" "filename" %s\n' % (
+            ts, pid, tid, name, filename)
+        ts += rng.randint(1, 1000)
+
+        if rng.random() < failure_ratio:
+            yield ts, 'TT01 %d %d %d "test" "failure" "I" "reason" %s "lineno" %d\n' % (
+                ts, pid, tid, _quote(_text(rng, arg_size, unicode)),
+                rng.randint(1, 5000))
+            ts += rng.randint(1, 100)
+
+        yield ts, 'TT01 %d %d %d "test" %s "E"\n' % (ts, pid, tid, name)
+        ts += rng.randint(1, 100)
+
+
+def generate_trace_lines(case_count, failure_ratio=0.1, arg_size=16,
+                         unicode=False, workers=1, seed=0):
+    """yield the TT01 lines of case_count test cases
+
+    cases are spread round robin over `workers` (pid, tid) pairs, which
+    run at the same time: their lines are interleaved by timestamp. A
+    failure_ratio share of the cases report a failure whose reason is
+    made of arg_size characters.
+    """
+    rng = random.Random(seed)
+    streams = [
+        _worker_trace_lines(
+            range(worker, case_count, workers), 140735319652704 + worker,
+            random.Random(rng.getrandbits(64)), failure_ratio, arg_size, unicode)
+        for worker in range(workers)
+    ]
+    for ts, line in heapq.merge(*streams):
+        yield line
+
+
+def generate_reports(case_count, failure_ratio=0.1, message_size=16,
+                     unicode=False, seed=0):
+    """the list of case_count test reports"""
+    rng = random.Random(seed)
+    ts = 1401278400.0
+    reports = []
+    for case in range(case_count):
+        duration = rng.random()
+        report = Report(
+            'test_%d%s' % (case, u'_λ' if unicode else ''),
+            start_ts=ts, end_ts=ts + duration,
+            src_location='tests.module_%d' % (case % 97),
+        )
+        if rng.random() < failure_ratio:
+            report.failures.append(_text(rng, message_size, unicode))
+        reports.append(report)
+        ts += duration
+    return reports
@@ -0,0 +1,59 @@
+"""measure how parse_file_in_parallel scales with the number of jobs
+
+the speedups printed are measured against the serial parser, on this
+host: no gain can be expected beyond its number of CPUs.
+"""
+import os
+import shutil
+import time
+
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+
+from xunitgen.event_traces import parse_file_in_parallel, parse_lines
+
+from .generator import generate_trace_lines
+
+
+def measure(parse, path):
+    start = time.perf_counter()
+    count = sum(1 for _ in parse(path))
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=1000000,
+                        help='approximate number of lines')
+    parser.add_argument('--max-jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    root_dir = mkdtemp()
+    try:
+        path = os.path.join(root_dir, 'trace.log')
+        with open(path, 'w') as outf:
+            outf.writelines(generate_trace_lines(args.lines // 2, failure_ratio=0.5))
+
+        def serial(path):
+            with open(path) as file:
+                for trace in parse_lines(file, path):
+                    yield trace
+
+        with open(path) as inf:
+            print('%d lines, %d CPUs' % (sum(1 for _ in inf), os.cpu_count()))
+        count, reference = measure(serial, path)
+        print('serial:   %8.2fs %12.0f traces/s' % (reference, count / reference))
+
+        jobs = 1
+        while jobs <= args.max_jobs:
+            count, elapsed = measure(
+                lambda path: parse_file_in_parallel(path, jobs), path)
+            print('jobs=%-3d %8.2fs %12.0f traces/s, speedup x%.2f' % (
+                jobs, elapsed, count / elapsed, reference / elapsed))
+            jobs *= 2
+    finally:
+        shutil.rmtree(root_dir)
+
+
+if __name__ == '__main__':
+    main()
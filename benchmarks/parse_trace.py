@@ -0,0 +1,79 @@
+"""compare the TT01 tokenizer against the original regex + eval parser"""
+import re
+import time
+
+from argparse import ArgumentParser
+
+from xunitgen.event_traces import parse_trace
+
+from .generator import generate_trace_lines
+
+
+def regex_parse_trace(line):
+    """the original parser, kept as a reference point"""
+    main_re = r'^TT01 ([0-9]+) ([0-9]+) ([0-9]+) ("(?:[^\\"]|\\.)*") ("(?:[^\\"]|\\.)*") ("[A-Z]")(.*)$'
+    match = re.match(main_re, line)
+    if match:
+        def get(i):
+            return match.group(i)
+
+        def unquote_str(string):
+            return eval(string)
+
+        trace = dict(
+            ts=int(get(1)),
+            pid=int(get(2)),
+            tid=int(get(3)),
+            cat=unquote_str(get(4)),
+            name=unquote_str(get(5)),
+            ph=unquote_str(get(6)),
+            args={},
+        )
+
+        arg_str = get(7)
+        if arg_str:
+            for match in re.finditer(r' ("(?:[^\\"]|\\.)*") ((?:"(?:[^\\"]|\\.)*")|(?:[0-9]+\.[0-9]*)|(?:[0-9]+))', arg_str):
+                name = unquote_str(get(1))
+                value_str = get(2)
+                if re.match(r'^"(?:[^\\"]|\\.)*"$', value_str):
+                    value = unquote_str(value_str)
+                elif re.match(r'^[0-9]+\.[0-9]*$', value_str):
+                    value = float(value_str)
+                elif re.match(r'^[0-9]+$', value_str):
+                    value = int(value_str)
+
+                trace['args'][name] = value
+
+            if not trace['args']:
+                raise Exception('Could not parse args %r' % arg_str)
+
+        return trace
+
+    raise Exception('Could not parse %r' % line)
+
+
+def measure(parse, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='approximate number of lines')
+    args = parser.parse_args()
+
+    lines = list(generate_trace_lines(args.lines // 2, failure_ratio=0.5))
+    for line in lines[:3]:
+        assert parse_trace(line) == regex_parse_trace(line), line
+
+    reference = measure(regex_parse_trace, lines)
+    tokenizer = measure(parse_trace, lines)
+    print('regex + eval: %12.0f lines/s' % reference)
+    print('tokenizer:    %12.0f lines/s (x%.1f)' % (tokenizer, tokenizer / reference))
+
+
+if __name__ == '__main__':
+    main()
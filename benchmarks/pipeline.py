@@ -0,0 +1,144 @@
+"""measure every stage of the trace to xunit pipeline
+
+for each stage, reports its throughput, the peak memory it allocates
+and the number of memory blocks it left allocated, mostly its result
+(the difference of tracemalloc snapshots taken around the stage).
+Results may be saved as a baseline, and later runs compared against it:
+
+    $ python -m benchmarks.pipeline --save-baseline baseline.json
+    $ python -m benchmarks.pipeline --baseline baseline.json
+"""
+import json
+import shutil
+import sys
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+from tempfile import mkdtemp
+
+from xunitgen import XunitDestination, toxml
+from xunitgen.event_traces import gather_test_results, parse_trace
+
+from .generator import generate_reports, generate_trace_lines
+
+
+def measure(fn, arg, repeat):
+    """run fn(arg) and return (its result, best seconds, peak bytes, blocks)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = fn(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(
+            stat.count_diff
+            for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    finally:
+        tracemalloc.stop()
+
+    return result, best, peak, blocks
+
+
+def run(args):
+    lines = list(generate_trace_lines(
+        args.cases, failure_ratio=args.failure_ratio, arg_size=args.arg_size,
+        unicode=args.unicode, workers=args.workers, seed=args.seed))
+    reports = generate_reports(
+        args.cases, failure_ratio=args.failure_ratio,
+        message_size=args.arg_size, unicode=args.unicode, seed=args.seed)
+
+    root_dir = mkdtemp()
+    try:
+        destination = XunitDestination(root_dir)
+        written = [0]
+
+        def write_reports(reports):
+            written[0] += 1
+            return destination.write_reports(
+                'suite-%d' % written[0], 'suite', reports)
+
+        stages = [
+            ('parse_trace', lambda lines: [parse_trace(line) for line in lines], lines, len(lines)),
+            ('gather_test_results', gather_test_results, None, None),
+            ('toxml', lambda reports: toxml(reports, 'suite'), reports, len(reports)),
+            ('write_reports', write_reports, reports, len(reports)),
+        ]
+
+        results = {}
+        previous = None
+        for name, fn, arg, count in stages:
+            if arg is None:
+                arg, count = previous, len(previous)
+            previous, seconds, peak, blocks = measure(fn, arg, args.repeat)
+            results[name] = dict(
+                items_per_second=count / seconds,
+                peak_bytes=peak,
+                blocks=blocks,
+            )
+        return results
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def compare(results, baseline, tolerance):
+    """print the results next to the baseline, returns the regressed stages"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        line = '%-20s %12.0f items/s %12d peak bytes %10d blocks' % (
+            name, result['items_per_second'], result['peak_bytes'], result['blocks'])
+        if reference is not None:
+            speed = result['items_per_second'] / reference['items_per_second']
+            memory = result['peak_bytes'] / float(max(reference['peak_bytes'], 1))
+            line += '   speed x%.2f memory x%.2f' % (speed, memory)
+            if speed < 1 - tolerance or memory > 1 + tolerance:
+                regressions.append(name)
+                line += '   REGRESSION'
+        print(line)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--cases', type=int, default=20000)
+    parser.add_argument('--failure-ratio', type=float, default=0.1)
+    parser.add_argument('--arg-size', type=int, default=16,
+                        help='size of the failure messages')
+    parser.add_argument('--unicode', action='store_true')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of (pid, tid) pairs in the traces')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='compare against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='acceptable relative slowdown or memory growth')
+    parser.add_argument('--save-baseline', help='save the results there')
+    args = parser.parse_args()
+
+    results = run(args)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as inf:
+            baseline = json.load(inf)['results']
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as outf:
+            json.dump(dict(parameters=vars(args), results=results), outf, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""compare the direct xunit serializer against ElementTree"""
+import time
+
+from argparse import ArgumentParser
+from socket import gethostname
+from xml.etree import ElementTree as et
+
+from xunitgen import toxml
+from xunitgen.main import (
+    _quote_attribute, _testsuite_attributes, format_seconds, format_timestamp,
+)
+
+from .generator import generate_reports
+
+
+def etree_toxml(test_reports, suite_name,
+                hostname=gethostname(), package_name="tests"):
+    """the original ElementTree serializer, kept as a reference point"""
+    testsuites = et.Element("testsuites")
+    testsuite = et.SubElement(testsuites, "testsuite")
+
+    ts = min(r.start_ns for r in test_reports)
+    testsuite.attrib = _testsuite_attributes(
+        len([r for r in test_reports if r.errors]),
+        len([r for r in test_reports if r.failures]),
+        len(test_reports), hostname, format_timestamp(ts),
+        format_seconds(max(r.end_ns for r in test_reports) - ts),
+        suite_name, package_name,
+    )
+
+    for r in test_reports:
+        testcase = et.SubElement(testsuite, "testcase")
+        testcase.attrib = dict(
+            name=r.name,
+            classname=_quote_attribute(r.src_location),
+            time=format_seconds(r.end_ns - r.start_ns),
+        )
+        if r.properties:
+            properties = et.SubElement(testcase, "properties")
+            for name, value in r.properties:
+                prop = et.SubElement(properties, "property")
+                prop.attrib = dict(name=name, value='%s' % value)
+        if r.failures or r.errors:
+            tag, messages = ("failure", r.failures) if r.failures else ("error", r.errors)
+            et.SubElement(testcase, tag).attrib = dict(
+                type="exception",
+                message=_quote_attribute('\n'.join(['%s' % e for e in messages])),
+            )
+        if r.system_out:
+            et.SubElement(testcase, "system-out").text = r.system_out
+
+    return et.tostring(testsuites, encoding="utf-8")
+
+
+def measure(serialize, reports, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialize(reports, 'suite')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(reports) / best
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--cases', type=int, default=100000)
+    parser.add_argument('--failure-ratio', type=float, default=0.1)
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--unicode', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    reports = generate_reports(
+        args.cases, failure_ratio=args.failure_ratio,
+        message_size=args.message_size, unicode=args.unicode)
+    assert toxml(reports, 'suite') == etree_toxml(reports, 'suite')
+
+    reference = measure(etree_toxml, reports, args.repeat)
+    direct = measure(toxml, reports, args.repeat)
+    print('ElementTree: %12.0f cases/s' % reference)
+    print('direct:      %12.0f cases/s (x%.1f)' % (direct, direct / reference))
+
+
+if __name__ == '__main__':
+    main()
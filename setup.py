@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 setup(
     name="xunitgen",
-    version="1.0.3",
+    version="2.0.0",
     description="Generate xUnit.xml files",
     author="Nicolas Léveillé",
     author_email="nicolas@uucidl.com",
     url="https://github.com/uucidl/uu.xunitgen",
     packages=["xunitgen"],
     license='MIT',
+    python_requires='>=3.8',
 )
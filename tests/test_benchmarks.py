@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+import xunitgen.event_traces
+
+from benchmarks.generator import generate_reports, generate_trace_lines
+
+
+class TestGenerator(TestCase):
+    def test_same_seed_same_workload(self):
+        for seed in [0, 1]:
+            self.assertEquals(
+                list(generate_trace_lines(50, workers=3, seed=seed)),
+                list(generate_trace_lines(50, workers=3, seed=seed)))
+            self.assertEquals(
+                generate_reports(50, seed=seed), generate_reports(50, seed=seed))
+        self.assertNotEqual(
+            list(generate_trace_lines(50, seed=0)), list(generate_trace_lines(50, seed=1)))
+
+    def test_workers_interleave_their_cases(self):
+        traces = list(xunitgen.event_traces.parse_lines(
+            generate_trace_lines(60, failure_ratio=0.5, workers=3)))
+        self.assertEquals(
+            sorted(trace['ts'] for trace in traces), [trace['ts'] for trace in traces])
+
+        open_cases = max_open_cases = 0
+        for trace in traces:
+            open_cases += dict(B=1, E=-1).get(trace['ph'], 0)
+            max_open_cases = max(max_open_cases, open_cases)
+        self.assertEquals(3, max_open_cases)
+
+        by_worker = xunitgen.event_traces.gather_test_results_by_worker(traces)
+        self.assertEquals(3, len(by_worker))
+        self.assertEquals([20, 20, 20], [len(reports) for reports in by_worker.values()])
+        assert not any(r.errors for reports in by_worker.values() for r in reports)
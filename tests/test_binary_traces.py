@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import xunitgen.event_traces
+
+from xunitgen.binary_traces import (
+    EVENT,
+    BinaryTraceDecoder,
+    BinaryTraceWriter,
+    convert_tt01,
+    iter_binary_traces,
+    read_binary_traces,
+)
+
+
+LINES = [
+    'TT01 0 33366 140735319652704 "test" "a-test" "B" "filename" "foo"\n',
+    r'TT01 1000000 33366 140735319652704 "test" "failure" "I" "reason" "世 \"r\"" "lineno" 4 "ratio" 0.5' + '\n',
+    'TT01 2000000 33366 140735319652704 "test" "a-test" "E"\n',
+]
+
+
+class TestBinaryTraces(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.traces = list(xunitgen.event_traces.parse_lines(LINES))
+        self.data = io.BytesIO()
+        convert_tt01(self.traces, self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_file_round_trip(self):
+        path = os.path.join(self.root_dir, 'trace.tb')
+        with open(path, 'wb') as outf:
+            outf.write(self.data.getvalue())
+
+        self.assertEquals(self.traces, list(iter_binary_traces(path)))
+        self.assertEquals(
+            1, len(xunitgen.event_traces.gather_test_results(
+                iter_binary_traces(path))))
+
+    def test_truncated_file(self):
+        path = os.path.join(self.root_dir, 'trace.tb')
+        with open(path, 'wb') as outf:
+            outf.write(self.data.getvalue()[:-3])
+
+        self.assertRaises(Exception, list, iter_binary_traces(path))
+
+    def test_decode_in_pieces(self):
+        data = self.data.getvalue()[4:]
+        decoder = BinaryTraceDecoder()
+        buffer = bytearray()
+        traces = []
+        for i in range(len(data)):
+            buffer += data[i:i + 1]
+            traces.extend(decoder.decode(buffer))
+            del buffer[:decoder.offset]
+
+        self.assertEquals(self.traces, traces)
+        self.assertEquals(0, len(buffer))
+
+    def test_read_stream(self):
+        self.data.seek(0)
+        self.assertEquals(
+            self.traces, list(read_binary_traces(self.data, chunk_size=7)))
+
+    def test_undefined_strings(self):
+        data = EVENT.pack(b'E', 0, 1, 1, b'B', 99, 99, 0)
+        try:
+            list(BinaryTraceDecoder().decode(data))
+            assert False
+        except Exception as e:
+            self.assertEquals(
+                "Could not decode record b'E' at offset 0: undefined string "
+                "or argument type 99", str(e))
+
+    def test_integers_beyond_64_bits(self):
+        trace = dict(self.traces[1], args=dict(lineno=2**63 - 1, ratio=-2**63))
+        writer = BinaryTraceWriter(io.BytesIO())
+        writer.write(trace)
+
+        trace['args']['lineno'] = 2**63
+        self.assertRaises(ValueError, writer.write, trace)
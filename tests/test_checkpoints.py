@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import xunitgen.event_traces
+
+from xunitgen.checkpoints import convert_incrementally, open_follower
+
+
+LINES = [
+    'TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n',
+    'TT01 1000000 1 1 "test" "a-test" "E"\n',
+    'TT01 2000000 1 1 "test" "b-test" "B" "filename" "foo"\n',
+    'TT01 3000000 1 1 "test" "failure" "I" "reason" "r" "lineno" 4\n',
+    'TT01 4000000 1 1 "test" "b-test" "E"\n',
+    'TT01 5000000 1 1 "test" "c-test" "B" "filename" "foo"\n',
+    'TT01 6000000 1 1 "test" "c-test" "E"\n',
+]
+
+
+class TestCheckpoints(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.path = os.path.join(self.root_dir, 'trace.log')
+        self.checkpoint_path = os.path.join(self.root_dir, 'trace.log.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def write(self, lines, mode='w'):
+        with open(self.path, mode) as outf:
+            outf.write(''.join(lines))
+
+    def full_conversion(self):
+        return xunitgen.event_traces.gather_test_results(
+            xunitgen.event_traces.parse_lines(LINES))
+
+    def test_resume_after_append(self):
+        self.write(LINES[:3] + ['TT01 3000000 1 1 "te'])
+        first = convert_incrementally(self.path, self.checkpoint_path)
+        self.assertEquals(2, len(first))
+        self.assertEquals(1, len(first[1].errors))
+
+        with open(self.checkpoint_path) as inf:
+            state = json.load(inf)
+        self.assertEquals(len(''.join(LINES[:3])), state['offset'])
+        self.assertEquals(1, len(state['open_cases']))
+
+        self.write(LINES[3:4][0][len('TT01 3000000 1 1 "te'):], mode='a')
+        self.write(LINES[4:], mode='a')
+        follower, resumed = open_follower(self.path, self.checkpoint_path)
+        follower.close()
+        assert resumed
+
+        reports = convert_incrementally(self.path, self.checkpoint_path)
+        self.assertEquals(self.full_conversion(), reports)
+        self.assertEquals(1, len(reports[1].failures))
+
+    def test_changed_prefix_is_parsed_again(self):
+        self.write(LINES[:2])
+        convert_incrementally(self.path, self.checkpoint_path)
+
+        with open(self.path, 'r+') as outf:
+            outf.write(''.join(LINES[:2]).replace('a-test', 'z-test'))
+        self.write(LINES[2:], mode='a')
+
+        follower, resumed = open_follower(self.path, self.checkpoint_path)
+        follower.close()
+        assert not resumed
+        reports = convert_incrementally(self.path, self.checkpoint_path)
+        self.assertEquals(3, len(reports))
+        self.assertEquals('z-test', reports[0].name)
+
+    def test_corrupt_checkpoint_is_ignored(self):
+        self.write(LINES)
+        with open(self.checkpoint_path, 'w') as outf:
+            outf.write('{')
+        self.assertEquals(
+            self.full_conversion(),
+            convert_incrementally(self.path, self.checkpoint_path))
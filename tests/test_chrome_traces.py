@@ -0,0 +1,51 @@
+import json
+
+from io import StringIO
+from unittest import TestCase
+
+from xunitgen import Report
+from xunitgen.chrome_traces import critical_path, write_chrome_trace
+
+
+def make_report(name, start_ms, end_ms):
+    ts_origin = 1401278400 * 10**9
+    return Report(name, src_location='foo', start_ns=ts_origin + start_ms * 10**6,
+                  end_ns=ts_origin + end_ms * 10**6)
+
+
+class TestChromeTraces(TestCase):
+    def test_critical_path(self):
+        self.assertEquals([], critical_path([], []))
+        self.assertEquals([0, 2], critical_path([0, 1, 5, 3], [5, 4, 9, 8]))
+        self.assertEquals([0, 1], critical_path([0, 0], [0, 0]))
+
+    def test_write_chrome_trace_by_worker(self):
+        outf = StringIO()
+        stats = write_chrome_trace({
+            (1, 1): [make_report('a', 0, 500), make_report('c', 600, 900)],
+            (1, 2): [make_report('b', 0, 700)],
+        }, outf)
+
+        trace = json.loads(outf.getvalue())
+        slices = [e for e in trace['traceEvents'] if e['ph'] == 'X' and e['cat'] == 'test']
+        self.assertEquals(['a', 'c', 'b'], [e['name'] for e in slices])
+        self.assertEquals([500000, 300000, 700000], [e['dur'] for e in slices])
+        self.assertEquals(stats, trace['otherData'])
+
+        self.assertEquals(2, stats['workers'])
+        self.assertEquals(['a', 'c'], stats['critical_path'])
+        self.assertEquals(100 * 10**6, stats['critical_path_idle_ns'])
+        self.assertAlmostEquals(1.5 / 1.8, stats['utilization'])
+
+    def test_reports_without_worker_get_lanes(self):
+        outf = StringIO()
+        stats = write_chrome_trace([
+            make_report('a', 0, 500), make_report('b', 100, 300),
+            make_report('c', 400, 600), make_report('d', 500, 700),
+        ], outf)
+
+        trace = json.loads(outf.getvalue())
+        lanes = dict((e['name'], e['tid']) for e in trace['traceEvents']
+                     if e.get('cat') == 'test')
+        self.assertEquals(dict(a=1, b=2, c=2, d=1), lanes)
+        self.assertEquals(2, stats['workers'])
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import shutil
+import socket
+import threading
+import time
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from xunitgen import XunitDestination
+from xunitgen.collector import TraceClient, TraceCollector
+from xunitgen.merging import load_xunit_reports
+
+
+class TestCollector(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.socket_path = os.path.join(self.root_dir, 'tests.sock')
+        self.collector = TraceCollector(XunitDestination(os.path.join(self.root_dir, 'out')))
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def collect(self, *producers):
+        """serve while running the producers, each in a thread of its own"""
+        async def run():
+            loop = asyncio.get_running_loop()
+            stop = loop.create_future()
+            server = asyncio.ensure_future(self.collector.serve(self.socket_path, stop))
+            while not os.path.exists(self.socket_path):
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*[
+                loop.run_in_executor(None, producer) for producer in producers
+            ])
+            stop.set_result(None)
+            await server
+
+        asyncio.run(run())
+
+    def test_connections_are_written_on_disconnect(self):
+        def producer(name, binary):
+            def produce():
+                with TraceClient(self.socket_path, name=name, binary=binary) as client:
+                    for i in range(3):
+                        client.begin_case('case-%d' % i, 'tests/module.c')
+                        if i == 1:
+                            client.failure('a "failure"\non two lines', 12)
+                        client.end_case('case-%d' % i)
+            return produce
+
+        self.collect(producer('binary', True), producer('text', False))
+
+        self.assertEquals([], self.collector.errors)
+        self.assertEquals(2, len(self.collector.written))
+        for name in ['binary', 'text']:
+            reports = load_xunit_reports(os.path.join(self.root_dir, 'out', name + '.xml'))
+            self.assertEquals(['case-0', 'case-1', 'case-2'], [r.name for r in reports])
+            self.assertEquals('tests.module', reports[0].src_location)
+            self.assertEquals(
+                'test failure a "failure"\non two lines at 12', '\n'.join(reports[1].failures))
+
+    def test_invalid_traces_are_reported(self):
+        def produce():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            sock.sendall(b'NAME garbage\nTT01 0 1 1 "test" "a" "B" "filename" "x.c"\nnot a trace\n')
+            sock.close()
+
+        self.collect(produce)
+
+        self.assertEquals(['garbage'], [path for path, _ in self.collector.errors])
+        # the case opened before the error is still written, as an error
+        reports = load_xunit_reports(os.path.join(self.root_dir, 'out', 'garbage.xml'))
+        self.assertEquals(1, len(reports[0].errors))
+
+    def test_invalid_names_are_rejected(self):
+        def producer(name):
+            def produce():
+                with TraceClient(self.socket_path, name=name) as client:
+                    client.begin_case('a-case', 'tests/module.c')
+                    client.end_case('a-case')
+            return produce
+
+        self.collect(producer('/tmp/absolute'), producer('../outside'))
+
+        self.assertEquals(2, len(self.collector.errors))
+        for _, error in self.collector.errors:
+            assert isinstance(error, ValueError)
+            self.assertTrue(str(error).startswith('invalid xunit file name'))
+        self.assertEquals([], self.collector.written)
+        self.assertFalse(os.path.exists(os.path.join(self.root_dir, 'outside.xml')))
+
+    def test_connections_sharing_a_name(self):
+        def produce():
+            with TraceClient(self.socket_path, name='shared') as client:
+                client.begin_case('a-case', 'tests/module.c')
+                client.end_case('a-case')
+
+        self.collect(produce, produce)
+
+        self.assertEquals([], self.collector.errors)
+        self.assertEquals(
+            ['shared-2.xml', 'shared.xml'],
+            sorted(os.listdir(os.path.join(self.root_dir, 'out'))))
+
+    def test_truncated_headers_are_reported(self):
+        def sender(data):
+            def produce():
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.socket_path)
+                sock.sendall(data)
+                sock.close()
+            return produce
+
+        self.collect(sender(b''), sender(b'TT'), sender(b'NAME named\nTB'))
+
+        self.assertEquals(
+            ['connection-2', 'named'],
+            sorted(path for path, _ in self.collector.errors))
+        self.assertEquals([], self.collector.written)
+
+    def test_reports_are_written_one_file_at_a_time(self):
+        destination = self.collector.destination
+        write_reports = destination.write_reports
+        lock = threading.Lock()
+        writing = []
+        overlaps = []
+
+        def slow_write_reports(*args, **kwargs):
+            with lock:
+                overlaps.append(len(writing))
+                writing.append(None)
+            time.sleep(0.05)
+            with lock:
+                writing.pop()
+            return write_reports(*args, **kwargs)
+        destination.write_reports = slow_write_reports
+
+        def producer(name):
+            def produce():
+                with TraceClient(self.socket_path, name=name) as client:
+                    client.begin_case('a-case', 'tests/module.c')
+                    client.end_case('a-case')
+            return produce
+
+        self.collect(*[producer('shard-%d' % i) for i in range(3)])
+
+        self.assertEquals([], self.collector.errors)
+        self.assertEquals([0, 0, 0], overlaps)
+        self.assertEquals(3, len(os.listdir(os.path.join(self.root_dir, 'out'))))
@@ -1,7 +1,17 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+
+from tempfile import mkdtemp
 from unittest import TestCase
 
 import xunitgen.event_traces
 
+from xunitgen.compression import open_input
+
 
 class TestParser(TestCase):
     def test_parse_trace(self):
@@ -47,6 +57,18 @@ class TestParser(TestCase):
         )
         self.assertEquals(trace, xunitgen.event_traces.parse_trace(line))
 
+    def test_parse_trace_with_c_escapes(self):
+        line = r'TT01 1 2 3 "test" "a\\b\"c\x41\101\u00e9\q" "I" "n" 12 "f" 1.'
+        trace = xunitgen.event_traces.parse_trace(line + '\n')
+        self.assertEquals(u'a\\b"cAA\u00e9\\q', trace['name'])
+        self.assertEquals(dict(n=12, f=1.0), trace['args'])
+
+    def test_parse_trace_rejects_garbage(self):
+        parse_trace = xunitgen.event_traces.parse_trace
+        self.assertRaises(Exception, parse_trace, 'TT02 1 2 3 "a" "b" "B"')
+        self.assertRaises(Exception, parse_trace, 'TT01 1 2 3 "a" "b" "B" garbage')
+        self.assertRaises(Exception, parse_trace, 'TT01 1 2 3 "a" "b" "B" "key"')
+
     def test_gather_test_results_trivial(self):
         self.assertEquals([], xunitgen.event_traces.gather_test_results([]))
 
@@ -65,3 +87,216 @@ class TestParser(TestCase):
             xunitgen.Report(
                 'a-test', start_ts=0.0, end_ts=9.0, src_location='foo'),
         ], xunitgen.event_traces.gather_test_results(traces))
+
+    def test_gather_test_results_keeps_microseconds(self):
+        traces = [
+            dict(ts=1401278400000001, cat='test', name='a-test', ph='B', args=dict(
+                filename='foo')
+            ),
+            dict(ts=1401278400000004, cat='test', name='a-test', ph='E'),
+        ]
+        report, = xunitgen.event_traces.gather_test_results(traces)
+        self.assertEquals(1401278400000001000, report.start_ns)
+        self.assertEquals(3000, report.duration_ns)
+
+    def test_iter_test_results_is_lazy(self):
+        def traces():
+            yield dict(ts=0, cat='test', name='a-test', ph='B', args=dict(
+                filename='foo'))
+            yield dict(ts=1000000, cat='test', name='a-test', ph='E')
+            raise AssertionError('consumed past the first case')
+
+        results = xunitgen.event_traces.iter_test_results(traces())
+        self.assertEquals('a-test', next(results).name)
+
+    def test_parse_lines_reports_line_numbers(self):
+        lines = [
+            'TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n',
+            'not a trace\n',
+        ]
+        traces = xunitgen.event_traces.parse_lines(lines, 'a.log')
+        next(traces)
+        try:
+            next(traces)
+            assert False
+        except Exception as e:
+            self.assertTrue(str(e).startswith('a.log:2: error:'), e)
+
+    def test_gather_interleaved_workers(self):
+        traces = [
+            dict(ts=0, pid=1, tid=1, cat='test', name='a-test', ph='B',
+                 args=dict(filename='foo')),
+            dict(ts=1000000, pid=1, tid=2, cat='test', name='b-test', ph='B',
+                 args=dict(filename='bar')),
+            dict(ts=2000000, pid=1, tid=2, cat='test', name='failure', ph='I',
+                 args=dict(reason='bad', lineno=3)),
+            dict(ts=3000000, pid=1, tid=1, cat='test', name='a-test', ph='E'),
+            dict(ts=4000000, pid=1, tid=2, cat='test', name='b-test', ph='E'),
+        ]
+
+        reports = xunitgen.event_traces.gather_test_results(traces)
+        self.assertEquals(['a-test', 'b-test'], [r.name for r in reports])
+        self.assertEquals([], reports[0].failures)
+        self.assertEquals(1, len(reports[1].failures))
+        assert not any(r.errors for r in reports)
+
+        by_worker = xunitgen.event_traces.gather_test_results_by_worker(traces)
+        self.assertEquals(['a-test'], [r.name for r in by_worker[1, 1]])
+        self.assertEquals(['b-test'], [r.name for r in by_worker[1, 2]])
+
+    def test_finish_by_worker_closes_cases_in_progress(self):
+        gatherer = xunitgen.event_traces.TestResultGatherer()
+        gatherer.feed(dict(ts=0, pid=1, tid=2, cat='test', name='a-test', ph='B',
+                           args=dict(filename='foo')))
+
+        results = gatherer.finish_by_worker()
+        self.assertEquals([(1, 2)], [worker for worker, case in results])
+        self.assertEquals(1, len(results[0][1].errors))
+
+
+class TestParallelParsing(TestCase):
+    LINES = [
+        'TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n',
+        'TT01 1000000 1 1 "test" "failure" "I" "reason" "r" "lineno" 4\n',
+        'TT01 2000000 1 1 "test" "a-test" "E"\n',
+        'TT01 3000000 1 1 "test" "b-test" "B" "filename" "bar"\n',
+        'TT01 4000000 1 1 "test" "b-test" "E"',
+    ]
+
+    def setUp(self):
+        self.root_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def write_log(self, lines):
+        path = os.path.join(self.root_dir, 'trace.log')
+        with open(path, 'w') as outf:
+            outf.write(''.join(lines))
+        return path
+
+    def test_compressed_logs(self):
+        data = ''.join(self.LINES).encode('utf-8')
+        for module in [gzip, bz2, lzma]:
+            path = os.path.join(self.root_dir, 'trace.log')
+            with module.open(path, 'wb') as outf:
+                outf.write(data)
+
+            with open_input(path) as file:
+                self.assertEquals(self.LINES, list(file))
+            with open(path, 'rb') as file:
+                self.assertEquals(self.LINES, list(open_input(io.BufferedReader(file))))
+
+    def test_chunk_ranges_end_on_newlines(self):
+        path = self.write_log(self.LINES)
+        ranges = xunitgen.event_traces.chunk_ranges(path, 10)
+        self.assertEquals(len(self.LINES), len(ranges))
+        self.assertEquals(0, ranges[0][0])
+        self.assertEquals(os.path.getsize(path), ranges[-1][1])
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEquals(end, start)
+
+    def test_parallel_parse_matches_serial_parse(self):
+        path = self.write_log(self.LINES)
+        traces = list(xunitgen.event_traces.parse_file_in_parallel(
+            path, 2, chunk_size=60))
+        self.assertEquals(
+            list(xunitgen.event_traces.parse_lines(self.LINES)), traces)
+        self.assertEquals(
+            2, len(xunitgen.event_traces.gather_test_results(traces)))
+
+        # a single job or chunk is parsed without a pool
+        for jobs, chunk_size in [(1, 60), (2, None)]:
+            self.assertEquals(traces, list(xunitgen.event_traces.parse_file_in_parallel(
+                path, jobs, chunk_size=chunk_size)))
+
+    def test_parallel_parse_beyond_binary_fields(self):
+        lines = self.LINES[:1] + [
+            'TT01 1000000 1 1 "test" "failure" "I" "reason" "r" "lineno" %d\n' % 2**64,
+        ] + self.LINES[2:]
+        path = self.write_log(lines)
+        self.assertEquals(
+            list(xunitgen.event_traces.parse_lines(lines)),
+            list(xunitgen.event_traces.parse_file_in_parallel(path, 2, chunk_size=60)))
+
+    def test_parallel_parse_reports_line_numbers(self):
+        path = self.write_log(self.LINES[:3] + ['garbage\n'] + self.LINES[3:])
+        try:
+            list(xunitgen.event_traces.parse_file_in_parallel(
+                path, 2, chunk_size=60))
+            assert False
+        except Exception as e:
+            self.assertTrue(':4: error:' in str(e), e)
+
+
+class TestFollowing(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.path = os.path.join(self.root_dir, 'trace.log')
+        open(self.path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def append(self, data):
+        with open(self.path, 'a') as outf:
+            outf.write(data)
+
+    def test_follower_waits_for_complete_lines(self):
+        follower = xunitgen.event_traces.TraceFollower(self.path)
+        self.addCleanup(follower.close)
+
+        self.append('TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n')
+        self.append('TT01 1000000 1 1 "test" "a-te')
+        self.assertEquals(0, follower.poll())
+        self.append('st" "E"\nTT01 2000000 1 1 "test" "b-test" "B" "filename" "foo"\n')
+        self.assertEquals(1, follower.poll())
+        self.assertEquals(['a-test'], [r.name for r in follower.reports])
+        assert not follower.reports[0].errors
+
+        self.assertEquals(1, follower.finish())
+        self.assertEquals(1, len(follower.reports[1].errors))
+
+    def test_follow_rewrites_the_xunit_file(self):
+        dst_path = os.path.join(self.root_dir, 'out.xml')
+        chunks = [
+            'TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n',
+            'TT01 1000000 1 1 "test" "a-test" "E"\n',
+            'TT01 2000000 1 1 "test" "b-test" "B" "filename" "foo"\n',
+        ]
+        now = [0.0]
+        seen = []
+
+        def sleep(seconds):
+            if os.path.exists(dst_path):
+                with open(dst_path) as inf:
+                    seen.append(inf.read().count('<testcase'))
+            if chunks:
+                self.append(chunks.pop(0))
+            now[0] += seconds
+
+        xunitgen.event_traces.follow(
+            self.path, dst_path, interval=1.0, idle_timeout=3.0,
+            poll_interval=1.0, clock=lambda: now[0], sleep=sleep,
+        )
+
+        self.assertEquals(1, max(seen))
+        with open(dst_path) as inf:
+            xml = inf.read()
+        self.assertEquals(2, xml.count('<testcase'))
+        assert 'finished unexpectedly' in xml
+
+    def test_follow_interrupted_with_a_partial_line(self):
+        dst_path = os.path.join(self.root_dir, 'out.xml')
+        self.append('TT01 0 1 1 "test" "a-test" "B" "filename" "foo"\n')
+        self.append('TT01 1000000 1 1 "test" "a-test" "E"\n')
+        self.append('TT01 2000000 1 1 "test" "b-te')
+
+        def sleep(seconds):
+            raise KeyboardInterrupt()
+
+        xunitgen.event_traces.follow(
+            self.path, dst_path, interval=10.0, sleep=sleep)
+
+        with open(dst_path) as inf:
+            self.assertEquals(1, inf.read().count('<testcase'))
@@ -1,4 +1,7 @@
+import asyncio
 import os
+import threading
+import tracemalloc
 import xml.etree.ElementTree as ET
 
 from datetime import datetime
@@ -8,11 +11,17 @@ from unittest import TestCase
 from lxml import etree as lxml_etree
 
 from xunitgen import (
+    AsyncRecorder,
+    ConcurrentRecorder,
     EventReceiver,
     Recorder,
     Report,
+    ReportBatch,
+    StepProfiler,
+    stream_xml,
     toxml,
 )
+from xunitgen.main import clock_ns, format_seconds, parse_seconds
 
 
 def validate_schema(xmlstring):
@@ -54,6 +63,36 @@ class TestFormat(TestCase):
 
         self.assertEquals(1, len(receiver.results()[0].failures))
 
+    def test_failure_messages_are_capped(self):
+        receiver = EventReceiver(max_messages=3, max_message_size=30)
+        for case in range(2):
+            receiver.begin_case('test-%d' % case, 0, 'foo')
+            for i in range(10):
+                receiver.failure('because', 4)
+            receiver.failure('x' * 100, 5)
+            receiver.end_case('test-%d' % case, 9)
+
+        first, second = receiver.results()
+        self.assertEquals(
+            ['test failure because at 4'] * 3 + ['(8 more failures dropped)'],
+            first.failures)
+        self.assertTrue(first.failures[0] is second.failures[0])
+
+        receiver.begin_case('test-long', 0, 'foo')
+        receiver.error('x' * 100)
+        self.assertEquals('error %s... (76 characters dropped)' % ('x' * 24),
+                          receiver.current_case.errors[0])
+
+    def test_shared_messages_are_bounded(self):
+        receiver = EventReceiver(max_messages=3)
+        for case in range(10):
+            receiver.begin_case('test-%d' % case, 0, 'foo')
+            receiver.failure('unique %d' % case, 4)
+            receiver.end_case('test-%d' % case, 9)
+        self.assertEquals(3, len(receiver.shared_messages))
+        self.assertEquals(
+            'test failure unique 9 at 4', receiver.results()[-1].failures[0])
+
 
     def test_recorder_is_a_context(self):
         self.assertRaises(Exception, Recorder(None, 'fake-name').step('step without recorder context'))
@@ -129,6 +168,23 @@ class TestFormat(TestCase):
         self.assertEquals('failing-step', reports[0].name)
         assert not reports[0].failures
         self.assertEquals(1, len(reports[0].errors), reports)
+        self.assertTrue(
+            'SentinelException (at %s:' % __file__ in reports[0].errors[0],
+            reports[0].errors)
+
+    def test_recorder_full_tracebacks(self):
+        destination = FakeDestination()
+        try:
+            with Recorder(destination, 'fake-name', full_tracebacks=True) as rec:
+                with rec.step('failing-step'):
+                    raise ValueError('boom')
+        except ValueError:
+            pass
+
+        _, reports, _ = destination.reports['fake-name']
+        message = reports[0].errors[0]
+        self.assertTrue(message.startswith('error Traceback'), message)
+        self.assertTrue(message.endswith('ValueError: boom'), message)
 
 
     def test_recorder_step_let_you_report_errors(self):
@@ -146,6 +202,221 @@ class TestFormat(TestCase):
         assert not reports[0].failures
 
 
+    def test_concurrent_recorder_overlapping_steps(self):
+        destination = FakeDestination()
+        barrier = threading.Barrier(4)
+
+        def probe(step):
+            barrier.wait(timeout=5)
+            if step.current_case.name == 'probe-2':
+                step.error('probe failed')
+            return step.current_case.name
+
+        with ConcurrentRecorder(destination, 'fake-name') as rec:
+            results = rec.run_steps(
+                [('probe-%d' % i, probe) for i in range(4)], max_workers=4,
+            )
+
+        self.assertEquals(['probe-%d' % i for i in range(4)], results)
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(4, len(reports))
+        self.assertEquals(
+            ['probe-2'], [r.name for r in reports if r.errors])
+
+    def test_concurrent_recorder_reraises_after_all_steps(self):
+        destination = FakeDestination()
+
+        def failing(step):
+            raise ValueError('failing step')
+
+        def run():
+            with ConcurrentRecorder(destination, 'fake-name') as rec:
+                rec.run_steps([('a', failing), ('b', lambda step: None)])
+
+        self.assertRaises(ValueError, run)
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(2, len(reports))
+
+    def test_concurrent_recorder_no_nested_step(self):
+        def inner_step(rec):
+            with rec.step('forbidden-inner-step'):
+                pass
+
+        destination = FakeDestination()
+        with ConcurrentRecorder(destination, 'fake-name') as rec:
+            with rec.step('normal-step'):
+                self.assertRaises(Exception, inner_step, rec)
+
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(1, len(reports))
+
+    def test_async_recorder_overlapping_steps(self):
+        destination = FakeDestination()
+
+        async def probe(rec, i):
+            async with rec.step('probe-%d' % i) as step:
+                await asyncio.sleep(0.01)
+                if i == 3:
+                    step.error('probe failed')
+
+        async def record():
+            async with AsyncRecorder(destination, 'fake-name') as rec:
+                await asyncio.gather(*[probe(rec, i) for i in range(10)])
+
+        asyncio.run(record())
+
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(10, len(reports))
+        self.assertEquals(['probe-3'], [r.name for r in reports if r.errors])
+
+    def test_async_recorder_no_nested_step_within_a_task(self):
+        destination = FakeDestination()
+
+        async def record():
+            async with AsyncRecorder(destination, 'fake-name') as rec:
+                async with rec.step('normal-step'):
+                    async with rec.step('forbidden-inner-step'):
+                        pass
+
+        self.assertRaises(Exception, asyncio.run, record())
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(1, len(reports))
+        self.assertEquals(1, len(reports[0].errors))
+
+    def test_report_equality_and_hash(self):
+        a = Report('a-test', start_ts=0, end_ts=1, src_location='foo')
+        b = Report('a-test', start_ts=0.0, end_ts=1.0, src_location='foo')
+        c = Report('a-test', start_ts=0, end_ts=1, src_location='foo')
+        c.errors.append('an error')
+
+        self.assertEquals(a, b)
+        self.assertNotEqual(a, c)
+        self.assertNotEqual(a, 'a-test')
+        self.assertEquals(2, len(set([a, b, c])))
+
+    def test_report_keeps_nanoseconds(self):
+        ts_origin = 1401278400 * 10**9
+        r = Report('a-test', start_ns=ts_origin + 1, end_ns=ts_origin + 1501)
+        self.assertEquals(1500, r.duration_ns)
+        self.assertEquals(Report('a-test', start_ts=1401278400, end_ts=1401278401),
+                          Report('a-test', start_ns=ts_origin, end_ns=ts_origin + 10**9))
+
+        for precision, expected in [(6, '0.000002'), (9, '0.000001500'), (0, '0')]:
+            root = ET.fromstring(toxml([r], 'a-suite', time_precision=precision))
+            self.assertEquals(expected, root.find('.//testcase').get('time'))
+            validate_schema(toxml([r], 'a-suite', time_precision=precision))
+
+    def test_event_receiver_nanoseconds(self):
+        receiver = EventReceiver()
+        receiver.begin_case_ns('a-test', 10**18 + 1, 'foo')
+        receiver.end_case_ns('a-test', 10**18 + 2)
+        self.assertEquals(1, receiver.results()[0].duration_ns)
+
+    def test_format_seconds(self):
+        self.assertEquals('1.500000', format_seconds(1500000000))
+        self.assertEquals('0.000001', format_seconds(500))
+        self.assertEquals('2.00', format_seconds(1999999999, 2))
+        self.assertEquals(1999999999, parse_seconds('1.999999999'))
+        self.assertRaises(ValueError, format_seconds, 1, 10)
+        self.assertRaises(ValueError, format_seconds, 1, -1)
+
+    def test_recorder_uses_a_monotonic_clock(self):
+        dest = FakeDestination()
+        with Recorder(dest, 'a-suite') as recorder:
+            before = clock_ns()
+            for i in range(3):
+                with recorder.step('step-%d' % i):
+                    pass
+            after = clock_ns()
+            results = recorder.results()
+
+        for previous, r in zip(results, results[1:]):
+            self.assertTrue(previous.end_ns <= r.start_ns)
+        self.assertTrue(before <= results[0].start_ns and results[-1].end_ns <= after)
+
+    def test_report_batch(self):
+        ts_origin = 1401278400
+        reports = []
+        for i in range(5):
+            r = Report(u'test-\u4e16-%d' % i, start_ts=ts_origin+i,
+                       end_ts=ts_origin+i+0.5, src_location='loc-%d' % (i % 2))
+            if i == 3:
+                r.failures.append('a failure')
+            reports.append(r)
+
+        batch = ReportBatch(reports)
+        self.assertEquals(5, len(batch))
+        self.assertEquals(2, len(batch.locations))
+        self.assertEquals(reports, list(batch))
+        self.assertEquals(reports[-1], batch[-1])
+        self.assertEquals(['a failure'], batch[3].failures)
+        self.assertRaises(IndexError, lambda: batch[5])
+        self.assertEquals(toxml(reports, 'batch'), toxml(batch, 'batch'))
+
+        batch.add(u'test-\u4e16-5', ts_origin+5, ts_origin+5.5, 'loc-1')
+        self.assertEquals(500000000, batch[5].duration_ns)
+        self.assertEquals(2, len(batch.locations))
+
+    def test_recorder_profiles_steps(self):
+        destination = FakeDestination()
+        with Recorder(destination, 'fake-name',
+                      profiler=StepProfiler(tracemalloc_top=3)) as rec:
+            with rec.step('allocating-step'):
+                data = [bytearray(1000) for _ in range(100)]
+
+        _, reports, _ = destination.reports['fake-name']
+        properties = dict(reports[0].properties)
+        assert 'cpu_time' in properties
+        assert reports[0].system_out.startswith('top allocations:')
+
+        testcase = ET.fromstring(toxml(reports, 'profiled')).find('.//testcase')
+        self.assertEquals(
+            properties['cpu_time'],
+            testcase.find('properties/property[@name="cpu_time"]').get('value'))
+        self.assertEquals(reports[0].system_out, testcase.findtext('system-out'))
+
+    def test_concurrent_recorder_profiles_overlapping_steps(self):
+        destination = FakeDestination()
+        first_started = threading.Event()
+        first_ended = threading.Event()
+
+        def first(step):
+            first_started.set()
+
+        def second(step):
+            first_started.wait()
+            # still tracing once the first step is over
+            first_ended.wait()
+            data = [bytearray(1000) for _ in range(100)]
+
+        profiler = StepProfiler(tracemalloc_top=3)
+        with ConcurrentRecorder(destination, 'fake-name', profiler=profiler) as rec:
+            original_end_step = rec.end_step
+
+            def end_step(step_name, event_receiver, token):
+                original_end_step(step_name, event_receiver, token)
+                if step_name == 'first':
+                    first_ended.set()
+
+            rec.end_step = end_step
+            rec.run_steps([('first', first), ('second', second)], max_workers=2)
+
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(['first', 'second'], sorted(r.name for r in reports))
+        for report in reports:
+            assert report.system_out.startswith('top allocations:')
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_recorder_does_not_profile_by_default(self):
+        destination = FakeDestination()
+        with Recorder(destination, 'fake-name') as rec:
+            with rec.step('a-step'):
+                pass
+
+        _, reports, _ = destination.reports['fake-name']
+        self.assertEquals(None, reports[0].properties)
+        self.assertEquals(None, ET.fromstring(toxml(reports, 'plain')).find('.//properties'))
+
 
     def test_toxml_without_report (self):
         self.assertRaises(ValueError, toxml, [], None)
@@ -248,4 +519,63 @@ class TestFormat(TestCase):
             '<a-test>', start_ts=ts_origin+0, end_ts=ts_origin+1, src_location=''
         )
         xunit_result = toxml([test_a], 'unicode-tests', 'test-hostname', package_name=None)
-        validate_schema(xunit_result)
\ No newline at end of file
+        validate_schema(xunit_result)
+
+
+    def test_toxml_writes_what_elementtree_would(self):
+        ts_origin = 1401278400
+        test_a = Report(
+            '<a & "test">\t', start_ts=ts_origin+0, end_ts=ts_origin+1,
+            src_location=u'\u4e16.\u754c'
+        )
+        test_a.failures.append('a failure\r\non two lines')
+        test_a.properties = [('cpu_time', 0.5), ('<name>', u'\u4e16')]
+        test_a.system_out = u'out & <err>\n\U0001f600'
+        test_b = Report('b-test', start_ts=ts_origin+1, end_ts=ts_origin+2)
+        test_b.errors.append('an error')
+        test_c = Report('c-test', start_ts=ts_origin+2, end_ts=ts_origin+3,
+                        src_location='foo')
+
+        validate_schema(toxml([test_b, test_c], '"suite"', 'test-hostname'))
+        # properties and system-out are not part of the schema
+        xunit_result = toxml([test_a, test_b, test_c], '"suite"', 'test-hostname')
+        self.assertEquals(
+            ET.tostring(ET.fromstring(xunit_result), encoding='utf-8'),
+            xunit_result,
+        )
+
+
+    def test_stream_xml_matches_toxml(self):
+        ts_origin = 1401278400
+        test_a = Report(
+            'a-test', start_ts=ts_origin+0, end_ts=ts_origin+1, src_location='foo'
+        )
+        test_a.failures.append('this is a "failure"')
+        test_b = Report(
+            '<b-test>', start_ts=ts_origin+3, end_ts=ts_origin+5,
+            src_location=u'\u4e16\u754c'
+        )
+        test_b.errors.append('this is an error')
+        test_reports = [test_a, test_b]
+
+        outf = BytesIO()
+        count = stream_xml(
+            (r for r in test_reports), outf, 'stream-tests',
+            hostname='test-hostname', package_name='pkg',
+        )
+        self.assertEquals(2, count)
+        validate_schema(outf.getvalue())
+
+        def attributes(xmlstring):
+            root = ET.fromstring(xmlstring)
+            return [e.attrib for e in root.iter()]
+
+        self.assertEquals(
+            attributes(toxml(test_reports, 'stream-tests',
+                             hostname='test-hostname', package_name='pkg')),
+            attributes(outf.getvalue()),
+        )
+
+
+    def test_stream_xml_without_report(self):
+        self.assertRaises(ValueError, stream_xml, iter([]), BytesIO(), None)
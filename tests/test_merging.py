@@ -0,0 +1,63 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+from datetime import datetime
+from io import BytesIO
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from xunitgen import Report, XunitDestination
+from xunitgen.merging import iter_xunit_reports, merge_xunit_files
+
+
+class TestMerging(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        ts_origin = 1401278400
+        self.paths = []
+        for shard in range(3):
+            destination = XunitDestination(self.root_dir, compress=shard == 1)
+            reports = []
+            for i in range(4):
+                start_ts = ts_origin + 10 * shard + i
+                report = Report('case-%d-%d' % (shard, i), start_ts=start_ts,
+                                end_ts=start_ts + 0.5, src_location='shard%d' % shard)
+                if i == 2:
+                    report.failures.append('failed\non two lines')
+                if i == 3 and shard == 0:
+                    report.errors.append('an error')
+                reports.append(report)
+            self.paths.append(destination.write_reports(
+                'shard-%d' % shard, 'shard-%d' % shard, reports))
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_iter_xunit_reports(self):
+        reports = list(iter_xunit_reports(self.paths[1]))
+        self.assertEquals(
+            ['case-1-%d' % i for i in range(4)], [r.name for r in reports])
+        self.assertEquals('shard1', reports[0].src_location)
+        self.assertEquals(['failed', 'on two lines'], reports[2].failures)
+        self.assertAlmostEquals(0.5, reports[3].end_ts - reports[3].start_ts)
+        self.assertEquals(1401278410, reports[0].start_ts)
+
+    def test_merge(self):
+        outputs = []
+        for jobs in [1, 2]:
+            outf = BytesIO()
+            count = merge_xunit_files(self.paths, outf, 'merged', jobs=jobs,
+                                      hostname='test-hostname')
+            self.assertEquals(12, count)
+            outputs.append(outf.getvalue())
+
+        self.assertEquals(outputs[0], outputs[1])
+        testsuite = ET.fromstring(outputs[0]).find('testsuite')
+        self.assertEquals('12', testsuite.get('tests'))
+        self.assertEquals('3', testsuite.get('failures'))
+        self.assertEquals('1', testsuite.get('errors'))
+        self.assertEquals(
+            datetime.fromtimestamp(1401278400).isoformat(),
+            testsuite.get('timestamp'))
+        self.assertEquals('23.500000', testsuite.get('time'))
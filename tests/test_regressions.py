@@ -0,0 +1,76 @@
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from xunitgen import Report, XunitDestination, toxml
+from xunitgen.regressions import DurationHistory, RegressionChecker
+
+
+def make_report(name, duration_ns):
+    ts_origin = 1401278400 * 10**9
+    return Report(name, src_location='foo', start_ns=ts_origin,
+                  end_ns=ts_origin + duration_ns)
+
+
+class TestRegressions(TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.history = DurationHistory()
+        destination = XunitDestination(self.root_dir)
+        for run, durations in enumerate([(100, 10), (120, 10), (110, 12)]):
+            path = destination.write_reports('run-%d' % run, 'suite', [
+                make_report('a-case', durations[0] * 10**6),
+                make_report('b-case', durations[1] * 10**6),
+            ])
+            self.history.load(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_history_from_xunit_files(self):
+        self.assertEquals(
+            [100 * 10**6, 120 * 10**6, 110 * 10**6],
+            self.history.get(make_report('a-case', 0)))
+
+    def test_ratio_flags_slow_cases(self):
+        checker = RegressionChecker(self.history, max_ratio=1.5)
+        reports = [
+            make_report('a-case', 160 * 10**6),
+            make_report('b-case', 20 * 10**6),
+            make_report('c-case', 10**9),
+        ]
+        checked = list(checker.check_reports('suite', reports))
+
+        self.assertEquals([], checked[0].failures)
+        self.assertEquals(1, len(checked[1].failures))
+        self.assertTrue(checked[1].failures[0].startswith('took 0.020000s'))
+        self.assertEquals([], checked[2].failures)
+        self.assertTrue(b'failures="1"' in toxml(checked, 'suite'))
+
+        summary = checker.summaries['suite']
+        self.assertEquals(3, summary['tests'])
+        self.assertEquals(1, summary['unknown'])
+        self.assertEquals(1, summary['regressions'])
+        self.assertEquals(120 * 10**6, summary['baseline_ns'])
+
+    def test_every_budget_must_be_exceeded(self):
+        checker = RegressionChecker(
+            self.history, max_ratio=1.5, max_increase_ns=50 * 10**6)
+        report = make_report('b-case', 20 * 10**6)
+        self.assertFalse(checker.check('suite', report))
+
+        checker = RegressionChecker(self.history, percentile=100)
+        self.assertTrue(checker.check('suite', make_report('a-case', 121 * 10**6)))
+
+    def test_summary_round_trip(self):
+        path = os.path.join(self.root_dir, 'summary.json')
+        self.history.save_summary(path)
+        history = DurationHistory(max_samples=2)
+        history.load(path)
+        self.assertEquals(
+            [120 * 10**6, 110 * 10**6], history.get(make_report('a-case', 0)))
+
+    def test_a_budget_is_required(self):
+        self.assertRaises(ValueError, RegressionChecker, self.history)
@@ -0,0 +1,71 @@
+import os
+import shutil
+
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from xunitgen import Report, XunitDestination
+from xunitgen.sharding import (
+    DurationEstimates, compare_makespan, makespan_ns, plan_shards, read_test_list,
+)
+
+
+def make_report(name, duration_ms):
+    ts_origin = 1401278400 * 10**9
+    return Report(name, src_location='foo', start_ns=ts_origin,
+                  end_ns=ts_origin + duration_ms * 10**6)
+
+
+class TestSharding(TestCase):
+    def test_estimates_are_moving_averages(self):
+        root_dir = mkdtemp()
+        try:
+            destination = XunitDestination(root_dir)
+            estimates = DurationEstimates(alpha=0.5)
+            for run, duration_ms in enumerate([100, 200]):
+                estimates.add_xunit_file(destination.write_reports(
+                    'run-%d' % run, 'suite', [make_report('a-case', duration_ms)]))
+        finally:
+            shutil.rmtree(root_dir)
+
+        self.assertEquals(150 * 10**6, estimates.get(('foo', 'a-case')))
+        self.assertEquals(150 * 10**6, estimates.get(('foo', 'unknown')))
+
+    def test_longest_processing_time_first(self):
+        estimates = DurationEstimates()
+        for name, duration_ms in [('a', 70), ('b', 50), ('c', 40), ('d', 30), ('e', 20)]:
+            estimates.add(make_report(name, duration_ms))
+
+        shards = plan_shards(list(estimates.estimates), 2, estimates)
+        self.assertEquals([['foo', 'a'], ['foo', 'd']], shards[0]['tests'])
+        self.assertEquals([['foo', 'b'], ['foo', 'c'], ['foo', 'e']], shards[1]['tests'])
+        self.assertEquals(110 * 10**6, makespan_ns(shards))
+
+        comparison = compare_makespan(shards, [
+            [make_report('a', 90), make_report('d', 30)],
+            [make_report('b', 50), make_report('c', 40), make_report('e', 20)],
+        ])
+        self.assertEquals(110 * 10**6, comparison['predicted_makespan_ns'])
+        self.assertEquals(120 * 10**6, comparison['actual_makespan_ns'])
+        self.assertEquals(120 * 10**6, comparison['shards'][0]['actual_ns'])
+
+    def test_at_least_one_shard(self):
+        self.assertRaises(ValueError, plan_shards, [], 0, DurationEstimates())
+
+    def test_read_test_list(self):
+        root_dir = mkdtemp()
+        try:
+            path = os.path.join(root_dir, 'tests.txt')
+            with open(path, 'w') as outf:
+                outf.write('foo\ta\n\nfoo\tb c\n')
+            self.assertEquals([('foo', 'a'), ('foo', 'b c')], read_test_list(path))
+
+            with open(path, 'a') as outf:
+                outf.write('foo d\n')
+            try:
+                read_test_list(path)
+                assert False
+            except ValueError as e:
+                self.assertTrue(str(e).startswith('%s:4: expected' % path), e)
+        finally:
+            shutil.rmtree(root_dir)
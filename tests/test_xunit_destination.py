@@ -1,12 +1,16 @@
+import gzip
+import json
 import os
 import shutil
+import xml.etree.ElementTree as ET
 
 from unittest import TestCase
 from tempfile import mkdtemp
 
 from xunitgen import (
-    XunitDestination, Report
+    XunitDestination, XunitWriteError, Report
 )
+from xunitgen.disk_writing import replace_report_file
 
 
 class TestXunitDestination(TestCase):
@@ -60,9 +64,251 @@ class TestXunitDestination(TestCase):
         self.destination.reserve_file('b-file')
 
 
+    def test_reserve_files(self):
+        paths = self.destination.reserve_files(
+            ['a-file', os.path.join('a', 'b', 'c'), os.path.join('a', 'b', 'd')])
+        self.assertEquals(os.path.join(self.root_dir, 'a-file.xml'), paths[0])
+        assert os.path.isdir(os.path.join(self.root_dir, 'a', 'b'))
+        self.assertRaises(ValueError, self.destination.reserve_file, 'a-file')
+        self.assertRaises(Exception, self.destination.check)
+
+        for path in paths:
+            with open(path, 'w') as outf:
+                outf.write('garbage')
+        self.destination.check()
+
+
+    def test_reserve_files_is_all_or_nothing(self):
+        with open(os.path.join(self.root_dir, 'hello.xml'), 'w') as outf:
+            outf.write('garbage')
+        self.assertRaises(
+            ValueError, self.destination.reserve_files, ['a-file', 'hello'])
+        self.assertRaises(
+            ValueError, self.destination.reserve_files, ['a-file', 'a-file'])
+        self.destination.reserve_file('a-file')
+
+
+    def test_check_reports_missing_files(self):
+        self.destination.reserve_file(os.path.join('a', 'missing'))
+        self.assertRaises(Exception, self.destination.check)
+
+
     def test_write_reports(self):
         ts_origin = 1401278400
         path = self.destination.write_reports('hello', 'a-suite', [Report('a-case', start_ts=ts_origin+0, end_ts=ts_origin+0)])
         assert os.path.isfile(path)
         self.destination.check()
         self.assertRaises(ValueError, self.destination.reserve_file, 'hello')
+
+
+    def test_stream_reports(self):
+        ts_origin = 1401278400
+        reports = (
+            Report('case-%d' % i, start_ts=ts_origin+i, end_ts=ts_origin+i+1)
+            for i in range(10)
+        )
+        path = self.destination.stream_reports('hello', 'a-suite', reports)
+        assert os.path.isfile(path)
+        self.destination.check()
+
+
+    def test_stream_reports_removes_partial_files(self):
+        ts_origin = 1401278400
+
+        def reports():
+            yield Report('a-case', start_ts=ts_origin, end_ts=ts_origin+1)
+            raise IOError('trace log went away')
+
+        self.assertRaises(
+            IOError, self.destination.stream_reports, 'partial', 'a-suite', reports())
+        assert not os.path.exists(os.path.join(self.root_dir, 'partial.xml'))
+        self.assertRaises(Exception, self.destination.check)
+
+
+    def test_write_many(self):
+        ts_origin = 1401278400
+        jobs = (
+            (os.path.join('shard-%d' % (i % 3), 'suite-%d' % i), 'suite-%d' % i,
+             [Report('a-case', start_ts=ts_origin+i, end_ts=ts_origin+i+1)])
+            for i in range(20)
+        )
+        paths = self.destination.write_many(jobs, max_workers=4, max_in_flight=2)
+        self.assertEquals(20, len(paths))
+        assert all(os.path.isfile(path) for path in paths)
+        self.destination.check()
+
+
+    def test_write_many_reports_all_errors(self):
+        ts_origin = 1401278400
+        self.destination.reserve_file('never-written')
+        jobs = [
+            ('good', 'good', [Report('a-case', start_ts=ts_origin, end_ts=ts_origin)]),
+            ('empty', 'empty', []),
+        ]
+        try:
+            self.destination.write_many(jobs, max_workers=2)
+            assert False
+        except XunitWriteError as e:
+            self.assertEquals(
+                [os.path.join(self.root_dir, 'empty.xml')], list(e.errors))
+            self.assertEquals(set([
+                os.path.join(self.root_dir, 'empty.xml'),
+                os.path.join(self.root_dir, 'never-written.xml'),
+            ]), e.missing)
+        assert os.path.isfile(os.path.join(self.root_dir, 'good.xml'))
+
+
+    def test_write_many_reports_reservation_errors(self):
+        ts_origin = 1401278400
+        jobs = [
+            (name, name, [Report('a-case', start_ts=ts_origin, end_ts=ts_origin)])
+            for name in ['twice', 'twice', 'once']
+        ]
+        try:
+            self.destination.write_many(jobs, max_workers=2)
+            assert False
+        except XunitWriteError as e:
+            self.assertEquals(['twice'], list(e.errors))
+            assert isinstance(e.errors['twice'], ValueError)
+            self.assertEquals(set(), e.missing)
+        for name in ['twice', 'once']:
+            assert os.path.isfile(os.path.join(self.root_dir, name + '.xml'))
+        self.destination.check()
+
+
+    def test_write_many_with_processes(self):
+        ts_origin = 1401278400
+        jobs = [
+            ('suite-%d' % i, 'suite-%d' % i,
+             [Report('a-case', start_ts=ts_origin, end_ts=ts_origin+1)])
+            for i in range(3)
+        ]
+        paths = self.destination.write_many(jobs, max_workers=2, use_processes=True)
+        assert all(os.path.isfile(path) for path in paths)
+
+
+    def test_compressed_destination(self):
+        ts_origin = 1401278400
+        destination = XunitDestination(self.root_dir, compress=True)
+        reports = [Report('a-case', start_ts=ts_origin, end_ts=ts_origin+1)]
+
+        path = destination.write_reports('hello', 'a-suite', reports)
+        self.assertEquals(os.path.join(self.root_dir, 'hello.xml.gz'), path)
+        streamed_path = destination.stream_reports('world', 'a-suite', iter(reports))
+        destination.check()
+
+        for path in [path, streamed_path]:
+            with gzip.open(path) as inf:
+                assert inf.read().startswith(b'<testsuites>')
+
+        self.assertRaises(ValueError, self.destination.reserve_file, 'hello')
+        self.assertRaises(ValueError, destination.reserve_files, ['world'])
+
+
+    def test_replace_report_file(self):
+        ts_origin = 1401278400
+        path = os.path.join(self.root_dir, 'live.xml.gz')
+        for count in [1, 2]:
+            reports = [
+                Report('case-%d' % i, start_ts=ts_origin, end_ts=ts_origin+1)
+                for i in range(count)
+            ]
+            replace_report_file(path, 'a-suite', reports)
+            with gzip.open(path) as inf:
+                self.assertEquals(count, inf.read().count(b'<testcase'))
+        self.assertEquals(['live.xml.gz'], os.listdir(self.root_dir))
+
+
+    def test_replace_report_file_mode(self):
+        ts_origin = 1401278400
+        path = os.path.join(self.root_dir, 'live.xml')
+        reports = [Report('a-case', start_ts=ts_origin, end_ts=ts_origin+1)]
+        umask = os.umask(0o027)
+        try:
+            replace_report_file(path, 'a-suite', reports)
+        finally:
+            os.umask(umask)
+        self.assertEquals(0o640, os.stat(path).st_mode & 0o777)
+
+
+    def split_reports(self):
+        ts_origin = 1401278400
+        reports = []
+        for i in range(10):
+            report = Report('case-%d' % i, start_ts=ts_origin+i, end_ts=ts_origin+i+1,
+                            src_location='pkg%d.module%d' % (i % 2, i))
+            if i % 3 == 0:
+                report.failures.append('a failure')
+            reports.append(report)
+        return reports
+
+
+    def read_index(self, relative_path):
+        with open(os.path.join(self.root_dir, relative_path + '.index.json')) as inf:
+            return json.load(inf)
+
+
+    def test_write_reports_split_by_case_count(self):
+        paths = self.destination.write_reports(
+            'split', 'a-suite', self.split_reports(), max_cases=4)
+        self.assertEquals(3, len(paths))
+        self.destination.check()
+
+        index = self.read_index('split')
+        self.assertEquals([4, 4, 2], [entry['tests'] for entry in index['files']])
+        self.assertEquals([2, 1, 1], [entry['failures'] for entry in index['files']])
+        for path, entry in zip(paths, index['files']):
+            testsuite = ET.parse(path).getroot().find('testsuite')
+            self.assertEquals(str(entry['tests']), testsuite.get('tests'))
+            self.assertEquals(str(entry['failures']), testsuite.get('failures'))
+
+
+    def test_write_reports_split_by_size(self):
+        paths = self.destination.write_reports(
+            'split', 'a-suite', iter(self.split_reports()), max_bytes=1000)
+        self.assertTrue(len(paths) > 1)
+        for path in paths:
+            self.assertTrue(os.path.getsize(path) <= 1000)
+        self.assertEquals(
+            10, sum(entry['tests'] for entry in self.read_index('split')['files']))
+
+
+    def test_write_reports_split_by_classname(self):
+        paths = XunitDestination(self.root_dir, compress=True).write_reports(
+            'split', 'a-suite', self.split_reports(), classname_depth=1)
+        self.assertEquals(2, len(paths))
+        index = self.read_index('split')
+        self.assertEquals(
+            ['pkg0', 'pkg1'], [entry['classname_prefix'] for entry in index['files']])
+        self.assertEquals('a-suite.pkg0', index['files'][0]['suite_name'])
+        with gzip.open(paths[0]) as inf:
+            self.assertEquals(5, inf.read().count(b'<testcase'))
+
+
+    def test_split_reports_cap_open_files(self):
+        destination = XunitDestination(self.root_dir)
+        destination.MAX_OPEN_FILES = 1
+        paths = destination.write_reports(
+            'split', 'a-suite', self.split_reports(), classname_depth=1)
+        self.assertEquals(10, len(paths))
+        self.assertEquals(
+            ['pkg0', 'pkg1'] * 5,
+            [entry['classname_prefix'] for entry in self.read_index('split')['files']])
+        destination.check()
+
+
+    def test_split_reports_reserve_their_index(self):
+        self.destination.write_reports(
+            'split', 'a-suite', self.split_reports(), max_cases=4)
+        self.assertRaises(
+            ValueError, self.destination.reserve_file, 'split', suffix='.index.json')
+
+        destination = XunitDestination(self.root_dir)
+        self.assertRaises(
+            ValueError, destination.write_reports,
+            'split', 'a-suite', self.split_reports(), max_cases=4)
+        self.assertEquals(0, len(destination.expected_xunit_files))
+
+        self.assertRaises(
+            ValueError, destination.write_reports, 'empty', 'a-suite', [], max_cases=4)
+        destination.check()
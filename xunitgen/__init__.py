@@ -1,8 +1,12 @@
 from .main import (
     EventReceiver,
     Report,
+    ReportBatch,
+    XunitStreamWriter,
+    stream_xml,
     toxml,
 )
 
-from .disk_writing import XunitDestination
-from .step_recording import Recorder
+from .disk_writing import XunitDestination, XunitWriteError
+from .profiling import StepProfiler
+from .step_recording import AsyncRecorder, ConcurrentRecorder, Recorder
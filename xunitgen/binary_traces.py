@@ -0,0 +1,226 @@
+"""a compact binary counterpart to the TT01 text trace format
+
+A TB01 stream starts with the 4 bytes `TB01` and is followed by records,
+all little-endian and introduced by a one byte tag:
+
+- `S` defines a string: u32 id, u32 length and as many utf-8 bytes.
+  Categories, names, argument keys and string values refer to strings
+  by id, so each distinct string is only ever written once.
+
+- `E` is an event: u64 ts, u32 pid, u64 tid, one ascii byte of phase,
+  u32 category id, u32 name id, u16 argument count, followed by that
+  many fixed width arguments: u32 key id, one type byte (`i` for a
+  s64, `f` for a double, `s` for a u64 string id) and the 8 byte value.
+
+Decoding walks the buffer (usually a mmap) with struct.unpack_from, the
+only copies being made are those of the strings, once each.
+"""
+from argparse import ArgumentParser
+
+import mmap
+import os
+import struct
+
+MAGIC = b'TB01'
+
+MIN_INT = -(1 << 63)
+MAX_INT = (1 << 63) - 1
+
+STRING = struct.Struct('<cII')
+EVENT = struct.Struct('<cQIQcIIH')
+ARG_KEY = struct.Struct('<Ic')
+ARG_VALUES = {
+    b'i': struct.Struct('<q'),
+    b'f': struct.Struct('<d'),
+    b's': struct.Struct('<Q'),
+}
+ARG_SIZE = ARG_KEY.size + 8
+
+
+class BinaryTraceDecoder(object):
+    """decodes TB01 records into the same trace dictionaries as
+    event_traces.parse_trace
+
+    the decoder keeps the string table, so that a stream may be decoded
+    in pieces, as it arrives.
+    """
+
+    def __init__(self):
+        self.strings = {}
+
+    def decode(self, buffer, offset=0):
+        """yield the traces of all complete records in buffer[offset:]
+
+        once exhausted, self.offset is the position of the first byte
+        which was not consumed.
+        """
+        strings = self.strings
+        view = memoryview(buffer)
+        size = len(view)
+        self.offset = offset
+
+        while offset < size:
+            tag = view[offset:offset + 1].tobytes()
+            if tag == b'S':
+                if offset + STRING.size > size:
+                    break
+                _, string_id, length = STRING.unpack_from(view, offset)
+                start = offset + STRING.size
+                if start + length > size:
+                    break
+                strings[string_id] = str(view[start:start + length], 'utf-8')
+                offset = start + length
+
+            elif tag == b'E':
+                if offset + EVENT.size > size:
+                    break
+                _, ts, pid, tid, ph, cat, name, argc = EVENT.unpack_from(view, offset)
+                start = offset + EVENT.size
+                if start + argc * ARG_SIZE > size:
+                    break
+
+                try:
+                    args = {}
+                    for arg_offset in range(start, start + argc * ARG_SIZE, ARG_SIZE):
+                        key, kind = ARG_KEY.unpack_from(view, arg_offset)
+                        value, = ARG_VALUES[kind].unpack_from(view, arg_offset + ARG_KEY.size)
+                        args[strings[key]] = strings[value] if kind == b's' else value
+
+                    trace = dict(
+                        ts=ts,
+                        pid=pid,
+                        tid=tid,
+                        cat=strings[cat],
+                        name=strings[name],
+                        ph=ph.decode('ascii'),
+                        args=args,
+                    )
+                except KeyError as e:
+                    raise Exception(
+                        'Could not decode record %r at offset %d: undefined string '
+                        'or argument type %r' % (tag, offset, e.args[0]))
+
+                offset = start + argc * ARG_SIZE
+                yield trace
+
+            else:
+                raise Exception('Could not decode record %r at offset %d' % (tag, offset))
+
+            self.offset = offset
+
+
+def is_binary_trace(head):
+    return head.startswith(MAGIC)
+
+
+def iter_binary_traces(path):
+    """yield the traces of a TB01 file, walking it through mmap"""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise Exception('%s: error: empty binary trace' % path)
+
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if not is_binary_trace(data[:len(MAGIC)]):
+                raise Exception('%s: error: not a binary trace' % path)
+
+            decoder = BinaryTraceDecoder()
+            traces = decoder.decode(data, len(MAGIC))
+            try:
+                for trace in traces:
+                    yield trace
+            finally:
+                # releases the generator's view of the mapping
+                traces.close()
+
+            if decoder.offset != len(data):
+                raise Exception('%s: error: truncated record at offset %d' % (
+                    path, decoder.offset))
+        finally:
+            data.close()
+
+
+def read_binary_traces(file, chunk_size=1 << 16):
+    """yield the traces of a TB01 binary stream (a pipe, a socket...)"""
+    buffer = bytearray(file.read(len(MAGIC)))
+    if not is_binary_trace(bytes(buffer)):
+        raise Exception('not a binary trace')
+    del buffer[:]
+
+    decoder = BinaryTraceDecoder()
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        buffer += data
+        for trace in decoder.decode(buffer):
+            yield trace
+        del buffer[:decoder.offset]
+
+    if buffer:
+        raise Exception('truncated record at end of binary trace')
+
+
+class BinaryTraceWriter(object):
+    """writes trace dictionaries as a TB01 stream into a binary file"""
+
+    def __init__(self, outf):
+        self.outf = outf
+        self.string_ids = {}
+        self.outf.write(MAGIC)
+
+    def intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = self.string_ids[string] = len(self.string_ids)
+            data = string.encode('utf-8')
+            self.outf.write(STRING.pack(b'S', string_id, len(data)))
+            self.outf.write(data)
+        return string_id
+
+    def write(self, trace):
+        args = []
+        for key, value in trace['args'].items():
+            if isinstance(value, float):
+                kind, value = b'f', value
+            elif isinstance(value, int):
+                if not MIN_INT <= value <= MAX_INT:
+                    raise ValueError(
+                        'argument %r of %r does not fit a signed 64 bit integer: %d' % (
+                            key, trace['name'], value))
+                kind, value = b'i', value
+            else:
+                kind, value = b's', self.intern(value)
+            args.append(ARG_KEY.pack(self.intern(key), kind) + ARG_VALUES[kind].pack(value))
+
+        record = EVENT.pack(
+            b'E', trace['ts'], trace['pid'], trace['tid'],
+            trace['ph'].encode('ascii'), self.intern(trace['cat']),
+            self.intern(trace['name']), len(args),
+        )
+        self.outf.write(record + b''.join(args))
+
+
+def convert_tt01(traces, outf):
+    """write TT01 traces (as parsed by event_traces) as a TB01 stream"""
+    writer = BinaryTraceWriter(outf)
+    for trace in traces:
+        writer.write(trace)
+
+
+def main():
+    from .compression import open_input
+    from .event_traces import parse_lines
+
+    parser = ArgumentParser(description='convert a TT01 trace log to TB01')
+    parser.add_argument("src_trace_log")
+    parser.add_argument("dst_binary_trace")
+    args = parser.parse_args()
+
+    with open_input(args.src_trace_log) as file:
+        with open(args.dst_binary_trace, 'wb') as outf:
+            convert_tt01(parse_lines(file, args.src_trace_log), outf)
+
+
+if __name__ == "__main__":
+    main()
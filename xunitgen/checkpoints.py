@@ -0,0 +1,152 @@
+"""resume the conversion of append-only TT01 trace logs
+
+a sidecar checkpoint file records how far a log was converted: the
+identity of the file, the offset after the last parsed line, a hash of
+everything before that offset, and the state of the conversion (the
+completed reports and the cases still open). A later conversion of the
+same log then only parses the bytes appended since.
+
+If the log was replaced or its prefix modified, the checkpoint is
+ignored and the log is parsed from the start.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from .event_traces import TraceFollower
+from .main import EventReceiver, Report
+
+VERSION = 2
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def report_to_json(report):
+    return dict(
+        name=report.name,
+        start_ns=report.start_ns,
+        end_ns=report.end_ns,
+        src_location=report.src_location,
+        failures=report.failures,
+        errors=report.errors,
+        properties=report.properties,
+        system_out=report.system_out,
+    )
+
+
+def report_from_json(value):
+    report = Report(
+        value['name'], src_location=value['src_location'],
+        start_ns=value['start_ns'], end_ns=value['end_ns'],
+    )
+    report.failures.extend(value['failures'])
+    report.errors.extend(value['errors'])
+    if value.get('properties'):
+        report.properties = [tuple(p) for p in value['properties']]
+    report.system_out = value.get('system_out')
+    return report
+
+
+def save_checkpoint(checkpoint_path, follower):
+    """atomically write the state of a TraceFollower to checkpoint_path"""
+    stat = os.fstat(follower.file.fileno())
+    state = dict(
+        version=VERSION,
+        device=stat.st_dev,
+        inode=stat.st_ino,
+        offset=follower.offset,
+        prefix_sha1=follower.digest.hexdigest(),
+        line_count=follower.line_count,
+        reports=[report_to_json(r) for r in follower.reports],
+        open_cases=[
+            dict(worker=list(worker), case=report_to_json(receiver.current_case))
+            for worker, receiver in follower.gatherer.receivers.items()
+            if receiver.current_case is not None
+        ],
+    )
+
+    checkpoint_dir, checkpoint_name = os.path.split(os.path.abspath(checkpoint_path))
+    fd, tmp_path = tempfile.mkstemp(dir=checkpoint_dir, prefix='.%s.' % checkpoint_name)
+    try:
+        with os.fdopen(fd, 'w') as outf:
+            json.dump(state, outf)
+        os.replace(tmp_path, checkpoint_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_checkpoint(checkpoint_path):
+    """the checkpoint state, or None if there is no usable checkpoint"""
+    try:
+        with open(checkpoint_path) as inf:
+            state = json.load(inf)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(state, dict) or state.get('version') != VERSION:
+        return None
+    return state
+
+
+def prefix_digest(file, offset):
+    """hash the first offset bytes of the file, None if it is shorter"""
+    digest = hashlib.sha1()
+    file.seek(0)
+    remaining = offset
+    while remaining > 0:
+        data = file.read(min(remaining, HASH_BLOCK_SIZE))
+        if not data:
+            return None
+        digest.update(data)
+        remaining -= len(data)
+    return digest
+
+
+def open_follower(src_trace_log, checkpoint_path):
+    """a TraceFollower over src_trace_log, resumed from the checkpoint
+    when it is still valid.
+
+    returns the follower and whether it was resumed.
+    """
+    follower = TraceFollower(src_trace_log, digest=hashlib.sha1())
+    state = load_checkpoint(checkpoint_path)
+    if state is None:
+        return follower, False
+
+    stat = os.fstat(follower.file.fileno())
+    if (stat.st_dev, stat.st_ino) != (state['device'], state['inode']):
+        return follower, False
+
+    digest = prefix_digest(follower.file, state['offset'])
+    if digest is None or digest.hexdigest() != state['prefix_sha1']:
+        follower.file.seek(0)
+        return follower, False
+
+    follower.digest = digest
+    follower.line_count = state['line_count']
+    follower.reports = [report_from_json(r) for r in state['reports']]
+    for open_case in state['open_cases']:
+        receiver = EventReceiver()
+        receiver.current_case = report_from_json(open_case['case'])
+        follower.gatherer.receivers[tuple(open_case['worker'])] = receiver
+
+    return follower, True
+
+
+def convert_incrementally(src_trace_log, checkpoint_path):
+    """convert a TT01 log, resuming from and then updating its checkpoint
+
+    returns the test reports of the whole log. A last line still being
+    written is left for the next conversion.
+    """
+    follower, _ = open_follower(src_trace_log, checkpoint_path)
+    try:
+        follower.poll()
+        save_checkpoint(checkpoint_path, follower)
+        follower.finish(parse_pending=False)
+    finally:
+        follower.close()
+
+    return follower.reports
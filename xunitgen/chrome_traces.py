@@ -0,0 +1,214 @@
+"""export test reports as a Chrome trace-event timeline
+
+the JSON written opens in Perfetto (ui.perfetto.dev) or about:tracing, and
+shows each test case as a slice on the thread of its worker. Idle gaps
+and test cases which did not overlap are then visible at a glance.
+
+Events are written one report at a time. Only the start and end of each
+case are kept, to compute once all are written:
+
+- the critical path: the chain of cases, going back from the last one to
+  end, where each case is the last to end before the next one started.
+  Its gaps are points where no test case was running.
+- the utilization: the time spent in test cases over the time the
+  workers were available, from the first start to the last end.
+
+These are written as "otherData" and the critical path is also shown as
+a track of its own.
+"""
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_right
+
+import heapq
+import json
+
+CRITICAL_PATH_PID = 0
+CRITICAL_PATH_TID = 0
+
+
+def _microseconds(ns):
+    return '%d.%03d' % divmod(ns, 1000)
+
+
+def critical_path(start_ns, end_ns):
+    """indexes of the cases on the critical path, in chronological order
+
+    start_ns and end_ns are the sequences of the start and end of each
+    case.
+    """
+    if not end_ns:
+        return []
+
+    by_end = sorted(range(len(end_ns)), key=end_ns.__getitem__)
+    ends = [end_ns[i] for i in by_end]
+
+    path = [by_end[-1]]
+    position = len(by_end) - 1
+    while True:
+        # the last case to end before the current one started
+        position = min(bisect_right(ends, start_ns[path[-1]]), position) - 1
+        if position < 0:
+            break
+        path.append(by_end[position])
+    path.reverse()
+    return path
+
+
+class ChromeTraceWriter(object):
+    """writes reports as complete ("X") trace events into a text file
+
+    write() takes the (pid, tid) worker of the report when it is known.
+    Reports without a worker are put on the first free lane of process
+    `pid`, which assumes they are written in the order they started.
+    """
+
+    def __init__(self, outf, pid=1):
+        self.outf = outf
+        self.pid = pid
+        self.workers = set()
+        self.lanes = []
+        self.start_ns = array('q')
+        self.end_ns = array('q')
+        self.names = []
+        self.busy_ns = 0
+
+        self.outf.write('{"displayTimeUnit": "ns", "traceEvents": [\n')
+        self.outf.write(json.dumps(dict(
+            name='process_name', ph='M', pid=CRITICAL_PATH_PID,
+            tid=CRITICAL_PATH_TID, args=dict(name='critical path'),
+        )))
+
+
+    def _event(self, event, ts_ns=None, dur_ns=None):
+        data = json.dumps(event)
+        if ts_ns is not None:
+            data = '%s, "ts": %s, "dur": %s}' % (
+                data[:-1], _microseconds(ts_ns), _microseconds(dur_ns))
+        self.outf.write(',\n')
+        self.outf.write(data)
+
+
+    def _lane(self, report):
+        if self.lanes and self.lanes[0][0] <= report.start_ns:
+            _, tid = self.lanes[0]
+            heapq.heapreplace(self.lanes, (report.end_ns, tid))
+        else:
+            tid = len(self.lanes) + 1
+            heapq.heappush(self.lanes, (report.end_ns, tid))
+        return self.pid, tid
+
+
+    def write(self, report, worker=None):
+        if worker is None:
+            worker = self._lane(report)
+        pid, tid = worker
+        if worker not in self.workers:
+            self.workers.add(worker)
+            self._event(dict(
+                name='thread_name', ph='M', pid=pid, tid=tid,
+                args=dict(name='worker %s/%s' % worker),
+            ))
+
+        status = 'error' if report.errors else 'failure' if report.failures else 'success'
+        self._event(
+            dict(name=report.name, cat='test', ph='X', pid=pid, tid=tid, args=dict(
+                classname=report.src_location, status=status,
+            )),
+            report.start_ns, report.end_ns - report.start_ns,
+        )
+
+        self.start_ns.append(report.start_ns)
+        self.end_ns.append(report.end_ns)
+        self.names.append(report.name)
+        self.busy_ns += report.end_ns - report.start_ns
+
+
+    def statistics(self):
+        """the critical path and utilization of the reports written"""
+        if not self.names:
+            return dict(tests=0, workers=0)
+
+        start = min(self.start_ns)
+        makespan_ns = max(self.end_ns) - start
+        path = critical_path(self.start_ns, self.end_ns)
+        path_busy_ns = sum(self.end_ns[i] - self.start_ns[i] for i in path)
+        return dict(
+            tests=len(self.names),
+            workers=len(self.workers),
+            makespan_ns=makespan_ns,
+            busy_ns=self.busy_ns,
+            utilization=float(self.busy_ns) / (makespan_ns * len(self.workers))
+            if makespan_ns else 1.0,
+            critical_path=[self.names[i] for i in path],
+            critical_path_busy_ns=path_busy_ns,
+            critical_path_idle_ns=makespan_ns - path_busy_ns,
+        )
+
+
+    def close(self):
+        """write the critical path and terminate the document, returns
+        the statistics"""
+        stats = self.statistics()
+        for i in critical_path(self.start_ns, self.end_ns):
+            self._event(
+                dict(name=self.names[i], cat='critical_path', ph='X',
+                     pid=CRITICAL_PATH_PID, tid=CRITICAL_PATH_TID),
+                self.start_ns[i], self.end_ns[i] - self.start_ns[i],
+            )
+        self.outf.write('\n], "otherData": %s}\n' % json.dumps(stats))
+        return stats
+
+
+def write_chrome_trace(reports, outf):
+    """write reports as a Chrome trace into a text file, returns the
+    statistics of ChromeTraceWriter
+
+    reports may also be a dict of reports by (pid, tid) worker, such as
+    gather_test_results_by_worker returns.
+    """
+    writer = ChromeTraceWriter(outf)
+    if isinstance(reports, dict):
+        for worker, worker_reports in reports.items():
+            for report in worker_reports:
+                writer.write(report, worker)
+    else:
+        for report in reports:
+            writer.write(report)
+    return writer.close()
+
+
+def format_statistics(stats):
+    if not stats['tests']:
+        return 'no test case'
+    return (
+        '%d tests on %d workers in %.3fs, %.1f%% utilization. critical path: '
+        '%d tests, idle for %.3fs' % (
+            stats['tests'], stats['workers'], stats['makespan_ns'] / 1e9,
+            100 * stats['utilization'], len(stats['critical_path']),
+            stats['critical_path_idle_ns'] / 1e9,
+        )
+    )
+
+
+def main():
+    from xunitgen.merging import iter_xunit_reports
+
+    parser = ArgumentParser(
+        description="export the test cases of xunit files as a Chrome trace. "
+        "Files are assumed to have run in parallel, each on a worker of its own",
+    )
+    parser.add_argument("dst_trace_file", help="Chrome trace-event JSON to write")
+    parser.add_argument("src_xunit_files", nargs="+")
+    args = parser.parse_args()
+
+    with open(args.dst_trace_file, 'w') as outf:
+        writer = ChromeTraceWriter(outf)
+        for tid, path in enumerate(args.src_xunit_files, 1):
+            for report in iter_xunit_reports(path):
+                writer.write(report, (1, tid))
+        print(format_statistics(writer.close()))
+
+
+if __name__ == "__main__":
+    main()
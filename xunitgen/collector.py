@@ -0,0 +1,275 @@
+"""collect test events from many processes over a Unix domain socket
+
+test processes connect to the collector and send their traces, in the
+TT01 or TB01 format, instead of writing a trace log. Every connection
+has its own TestResultGatherer, and its reports are written as a xunit
+file through a XunitDestination as soon as the producer disconnects.
+
+A connection may start with a `NAME <relative path>` line, naming the
+xunit file to write. It is otherwise named after the connection number.
+Connections sharing a name get a -2, -3... suffix after the first one,
+so that each writes a file of its own.
+The traces follow: a TB01 stream if they start with its magic bytes,
+TT01 lines otherwise.
+
+    $ python -m xunitgen.collector /tmp/tests.sock results/ &
+    $ ./run-tests --trace-socket /tmp/tests.sock
+"""
+from argparse import ArgumentParser
+
+import asyncio
+import contextlib
+import os
+import signal
+import socket
+import sys
+import threading
+
+from .binary_traces import MAGIC, BinaryTraceDecoder, BinaryTraceWriter
+from .disk_writing import XunitDestination
+from .event_traces import TestResultGatherer, format_trace, parse_trace
+from .main import clock_ns
+
+NAME_PREFIX = b'NAME'
+
+
+class TraceCollector(object):
+    """receives traces over a Unix domain socket, see the module
+    documentation
+
+    written holds the paths of the xunit files written so far, errors
+    the connections which sent invalid data (their reports up to that
+    point are still written).
+    """
+
+    CHUNK_SIZE = 1 << 16
+    # longest TT01 line accepted
+    LINE_LIMIT = 1 << 24
+
+    def __init__(self, destination, suite_name='testsuite', package_name=None):
+        self.destination = destination
+        self.suite_name = suite_name
+        self.package_name = package_name
+        self.connection_count = 0
+        self.name_counts = {}
+        self.written = []
+        self.errors = []
+        # created under the running loop, which asyncio.Lock binds to
+        # before Python 3.10
+        self.write_lock = None
+
+
+    async def handle_connection(self, reader, writer):
+        self.connection_count += 1
+        relative_path = 'connection-%d' % self.connection_count
+        gatherer = TestResultGatherer()
+        reports = []
+        named = False
+        try:
+            head = await reader.readexactly(len(MAGIC))
+            if head == NAME_PREFIX:
+                named = True
+                line = await reader.readline()
+                relative_path = self.unique_path(
+                    self.checked_path(line.decode('utf-8').strip()))
+                head = await reader.readexactly(len(MAGIC))
+
+            if head == MAGIC:
+                traces = self._binary_traces(reader)
+            else:
+                traces = self._text_traces(reader, head)
+            async for trace in traces:
+                reports.extend(gatherer.feed(trace))
+
+        except asyncio.IncompleteReadError as e:
+            # unless the producer disconnected before sending anything
+            if e.partial or named:
+                self.errors.append((relative_path, Exception(
+                    'connection closed before its first trace, after %r' % e.partial)))
+        except Exception as e:
+            self.errors.append((relative_path, e))
+        finally:
+            writer.close()
+
+        reports.extend(gatherer.finish())
+        if reports:
+            try:
+                await self.write_reports(relative_path, reports)
+            except Exception as e:
+                self.errors.append((relative_path, e))
+
+
+    def checked_path(self, relative_path):
+        parts = relative_path.split('/')
+        if not relative_path or os.path.isabs(relative_path) or '..' in parts:
+            raise ValueError('invalid xunit file name %r' % relative_path)
+        return relative_path
+
+
+    def unique_path(self, relative_path):
+        count = self.name_counts.get(relative_path, 0) + 1
+        self.name_counts[relative_path] = count
+        if count > 1:
+            return '%s-%d' % (relative_path, count)
+        return relative_path
+
+
+    async def _binary_traces(self, reader):
+        decoder = BinaryTraceDecoder()
+        buffer = bytearray()
+        while True:
+            data = await reader.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            buffer += data
+            for trace in decoder.decode(buffer):
+                yield trace
+            del buffer[:decoder.offset]
+
+        if buffer:
+            raise Exception('truncated record at end of binary trace')
+
+
+    async def _text_traces(self, reader, head):
+        line = head + await reader.readline()
+        while line:
+            if line.strip():
+                yield parse_trace(line.decode('utf-8'))
+            line = await reader.readline()
+
+
+    async def write_reports(self, relative_path, reports):
+        """write the reports of a connection from an executor, one file
+        at a time"""
+        loop = asyncio.get_running_loop()
+        if self.write_lock is None:
+            self.write_lock = asyncio.Lock()
+        async with self.write_lock:
+            path = await loop.run_in_executor(
+                None, lambda: self.destination.write_reports(
+                    relative_path, self.suite_name, reports,
+                    package_name=self.package_name,
+                ))
+        self.written.append(path)
+
+
+    async def serve(self, socket_path, stop):
+        """accept connections on socket_path until the stop future is
+        done, then wait for the connections in progress"""
+        connections = set()
+
+        def on_connection(reader, writer):
+            task = asyncio.ensure_future(self.handle_connection(reader, writer))
+            connections.add(task)
+            task.add_done_callback(connections.discard)
+
+        server = await asyncio.start_unix_server(
+            on_connection, path=socket_path, limit=self.LINE_LIMIT)
+        try:
+            await stop
+        finally:
+            server.close()
+            await server.wait_closed()
+            if connections:
+                await asyncio.gather(*connections)
+            # asyncio removes the socket itself from Python 3.13
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(socket_path)
+
+
+class TraceClient(object):
+    """sends test events to a TraceCollector, from any thread
+
+    the events mirror EventReceiver. They are sent as TB01 records, or
+    as TT01 lines with binary unset.
+    """
+
+    def __init__(self, socket_path, name=None, binary=True):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile('wb')
+        self.lock = threading.Lock()
+        if name is not None:
+            self.file.write(b'%s %s\n' % (NAME_PREFIX, name.encode('utf-8')))
+        self.writer = BinaryTraceWriter(self.file) if binary else None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def send(self, trace):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.write(trace)
+            else:
+                self.file.write(format_trace(trace).encode('utf-8'))
+
+
+    def _event(self, name, ph, **args):
+        self.send(dict(
+            ts=clock_ns() // 1000, pid=os.getpid(), tid=threading.get_native_id(),
+            cat='test', name=name, ph=ph, args=args,
+        ))
+
+
+    def begin_case(self, test_name, filename):
+        """the classname of the case is made from its source filename"""
+        self._event(test_name, 'B', filename=filename)
+
+
+    def end_case(self, test_name):
+        self._event(test_name, 'E')
+
+
+    def failure(self, reason, lineno):
+        self._event('failure', 'I', reason=reason, lineno=lineno)
+
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.socket.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("socket_path")
+    parser.add_argument("dst_dir", help="directory of the xunit files")
+    parser.add_argument("--suite-name", default="testsuite")
+    parser.add_argument("--package-name", default=None)
+    parser.add_argument(
+        "--compress", action="store_true", help="write gzip compressed xunit files",
+    )
+    args = parser.parse_args()
+
+    collector = TraceCollector(
+        XunitDestination(args.dst_dir, compress=args.compress),
+        suite_name=args.suite_name, package_name=args.package_name,
+    )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+        await collector.serve(args.socket_path, stop)
+
+    asyncio.run(run())
+    for relative_path, error in collector.errors:
+        sys.stderr.write('%s: error: %s\n' % (relative_path, error))
+    if collector.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
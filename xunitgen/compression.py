@@ -0,0 +1,79 @@
+"""transparent access to compressed trace logs and xunit files
+
+the compression is chosen by file extension or, for inputs, by sniffing
+the magic bytes at the start of the stream.
+"""
+import bz2
+import gzip
+import io
+import lzma
+
+EXTENSIONS = {
+    '.gz': gzip,
+    '.bz2': bz2,
+    '.xz': lzma,
+    '.lzma': lzma,
+}
+
+MAGIC_BYTES = [
+    (b'\x1f\x8b', gzip),
+    (b'BZh', bz2),
+    (b'\xfd7zXZ\x00', lzma),
+]
+
+GZIP_COMPRESSLEVEL = 6
+
+
+def compression_of(path, head=b''):
+    """the compression module for the path, or None if uncompressed"""
+    for extension, module in EXTENSIONS.items():
+        if path.endswith(extension):
+            return module
+
+    for magic, module in MAGIC_BYTES:
+        if head.startswith(magic):
+            return module
+
+    return None
+
+
+def sniff(path):
+    """the compression module for a file on disk, or None"""
+    with open(path, 'rb') as file:
+        return compression_of(path, file.read(8))
+
+
+def open_input(source, encoding='utf-8'):
+    """open a path or binary stream for reading text, decompressing it
+    on the fly if needed"""
+    if isinstance(source, str):
+        module = sniff(source)
+        if module is not None:
+            return module.open(source, 'rt', encoding=encoding)
+        return open(source, 'r', encoding=encoding)
+
+    if not hasattr(source, 'peek'):
+        source = io.BufferedReader(source)
+
+    module = compression_of('', source.peek(8)[:8])
+    if module is not None:
+        return module.open(source, 'rt', encoding=encoding)
+    return io.TextIOWrapper(source, encoding=encoding)
+
+
+def open_binary_input(path):
+    """open a path for reading bytes, decompressing it on the fly if needed"""
+    module = sniff(path)
+    if module is not None:
+        return module.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def open_output(path):
+    """open a path for writing bytes, compressing by extension"""
+    module = compression_of(path)
+    if module is gzip:
+        return gzip.open(path, 'wb', compresslevel=GZIP_COMPRESSLEVEL)
+    if module is not None:
+        return module.open(path, 'wb')
+    return open(path, 'wb')
@@ -1,55 +1,426 @@
+import json
 import os
+import shutil
+import tempfile
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .compression import compression_of, open_output
+from .main import TestcaseSerializer, XunitStreamWriter, toxml
+
+
+class XunitWriteError(Exception):
+    """raised when some reports of a bulk write could not be produced"""
+
+    def __init__(self, errors, missing):
+        super(XunitWriteError, self).__init__(
+            'failed to write %d result files %r, result files %r reserved '
+            'have not been produced' % (len(errors), errors, missing)
+        )
+        self.errors = errors
+        self.missing = missing
 
-from .main import toxml
 
 class XunitDestination(object):
-    """Manages a repository of xunit files, for writing test reports"""
+    """Manages a repository of xunit files, for writing test reports
+
+    with compress set, files are written gzip compressed as .xml.gz.
+    Durations are written with time_precision decimals.
+    """
 
-    def __init__(self, root_dir):
+    SUFFIXES = ('.xml', '.xml.gz')
+    # files kept open at once when splitting by classname
+    MAX_OPEN_FILES = 64
+
+    def __init__(self, root_dir, compress=False, time_precision=6):
         self.root_dir = root_dir
-        self.expected_xunit_files = []
+        self.compress = compress
+        self.time_precision = time_precision
+        self.expected_xunit_files = set()
+        self.known_dirs = set()
 
 
     def write_reports(self, relative_path, suite_name, reports,
-                      package_name=None):
-        """write the collection of reports to the given path"""
+                      package_name=None, max_cases=None, max_bytes=None,
+                      classname_depth=None):
+        """write the collection of reports to the given path
+
+        Huge suites may be split across several files, each a suite of
+        its own:
+
+        - max_cases: at most that many test cases per file
+        - max_bytes: files no larger than that, unless a single test
+          case is larger
+        - classname_depth: one series of files per distinct classname
+          prefix made of that many components of src_location. At most
+          MAX_OPEN_FILES series are written at once, the least recently
+          used one being closed to make room; its next test case then
+          starts a new file
+
+        When splitting, the files are written to <relative_path>.NNNN.xml
+        and an index describing them to <relative_path>.index.json; the
+        list of file paths is returned.
+        """
+        if max_cases is None and max_bytes is None and classname_depth is None:
+            dest_path = self.reserve_file(relative_path)
+            write_report_file(
+                dest_path, suite_name, reports, package_name, self.time_precision)
+            return dest_path
+
+        return self.write_split_reports(
+            relative_path, suite_name, reports, package_name=package_name,
+            max_cases=max_cases, max_bytes=max_bytes,
+            classname_depth=classname_depth,
+        )
+
+
+    def write_split_reports(self, relative_path, suite_name, reports,
+                            package_name=None, max_cases=None, max_bytes=None,
+                            classname_depth=None):
+        """see write_reports. reports may be any iterable."""
+        index = []
+        parts = {}
+        serializer = TestcaseSerializer(self.time_precision)
+        index_path = self.reserve_file(relative_path, suffix='.index.json')
+
+        def close_part(part):
+            part.close()
+            index.append(dict(
+                path=os.path.relpath(part.dest_path, self.root_dir),
+                suite_name=part.suite_name,
+                classname_prefix=part.classname_prefix,
+                tests=part.writer.test_count,
+                failures=part.writer.failure_count,
+                errors=part.writer.error_count,
+            ))
+
+        try:
+            for report in reports:
+                prefix = None
+                part_suite_name = suite_name
+                if classname_depth is not None:
+                    prefix = '.'.join(
+                        (report.src_location or '').split('.')[:classname_depth])
+                    part_suite_name = '%s.%s' % (suite_name, prefix) if prefix else suite_name
+
+                data = serializer.serialize(report)
+                part = parts.pop(prefix, None)
+                if part is not None and (
+                        (max_cases is not None and part.writer.test_count >= max_cases) or
+                        (max_bytes is not None and part.writer.size + len(data) > max_bytes)):
+                    close_part(part)
+                    part = None
+
+                if part is None:
+                    if len(parts) >= self.MAX_OPEN_FILES:
+                        close_part(parts.pop(next(iter(parts))))
+                    dest_path = self.reserve_file(
+                        '%s.%04d' % (relative_path, len(index) + len(parts)))
+                    part = _StreamedFile(
+                        dest_path, part_suite_name, package_name,
+                        self.time_precision)
+                    part.classname_prefix = prefix
+
+                # parts are kept from the least to the most recently used
+                parts[prefix] = part
+                part.writer.write(report, data)
+
+            for prefix in list(parts):
+                close_part(parts.pop(prefix))
+        finally:
+            for part in parts.values():
+                part.abort()
+
+        if not index:
+            self.expected_xunit_files.discard(index_path)
+            raise ValueError('there must be at least one test report')
+
+        index.sort(key=lambda entry: entry['path'])
+        with open(index_path, 'w') as outf:
+            json.dump(dict(suite_name=suite_name, files=index), outf, indent=2)
+
+        return [os.path.join(self.root_dir, entry['path']) for entry in index]
+
+
+    def stream_reports(self, relative_path, suite_name, reports,
+                       package_name=None, spans=()):
+        """write an iterable of reports to the given path, one at a time
+
+        unlike write_reports, the reports are never all held in memory.
+        The suite also covers the (start_ns, end_ns) spans, see
+        stream_xml.
+        """
+
+        reports = iter(reports)
+        first_report = next(reports, None)
+        if first_report is None:
+            raise ValueError('there must be at least one test report')
 
         dest_path = self.reserve_file(relative_path)
-        with open(dest_path, 'wb') as outf:
-            outf.write(toxml(reports, suite_name, package_name=package_name))
+        streamed_file = _StreamedFile(
+            dest_path, suite_name, package_name, self.time_precision)
+        try:
+            streamed_file.writer.write(first_report)
+            for report in reports:
+                streamed_file.writer.write(report)
+            for start_ns, end_ns in spans:
+                streamed_file.writer.cover(start_ns, end_ns)
+        except:
+            streamed_file.abort()
+            raise
+        streamed_file.close()
+
         return dest_path
 
 
-    def reserve_file(self, relative_path):
-        """reserve a XML file for the slice at <relative_path>.xml
+    def write_many(self, jobs, package_name=None, max_workers=None,
+                   max_in_flight=None, use_processes=False):
+        """write many (relative_path, suite_name, reports) jobs concurrently
 
-        - the relative path will be created for you
-        - not writing anything to that file is an error
+        reports are serialized and written on a pool of threads, or of
+        processes if use_processes is set. Jobs are consumed lazily and at
+        most max_in_flight of them (by default twice the number of
+        workers) are pending at any time.
+
+        Every job is attempted. Failures are then reported together with
+        any reserved file left unproduced, as a XunitWriteError. Its
+        errors are keyed by destination path, or by relative path for
+        the jobs whose file could not be reserved.
         """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_in_flight is None:
+            max_in_flight = 2 * max_workers
+
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        dest_paths = []
+        futures = []
+        errors = {}
+
+        with executor_class(max_workers=max_workers) as executor:
+            for relative_path, suite_name, reports in jobs:
+                try:
+                    dest_path = self.reserve_file(relative_path)
+                except Exception as e:
+                    errors[relative_path] = e
+                    continue
+                dest_paths.append(dest_path)
+
+                in_flight.acquire()
+                future = executor.submit(
+                    write_report_file, dest_path, suite_name, reports,
+                    package_name, self.time_precision,
+                )
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append((dest_path, future))
+
+        for dest_path, future in futures:
+            if future.exception() is not None:
+                errors[dest_path] = future.exception()
+
+        missing = self.missing_files()
+        if errors or missing:
+            raise XunitWriteError(errors, missing)
+
+        return dest_paths
+
+
+    def destination_path(self, relative_path, suffix=None):
         if os.path.isabs(relative_path):
             raise ValueError('%s must be a relative path' % relative_path)
 
-        dest_path = os.path.join(self.root_dir, '%s.xml' % relative_path)
+        if suffix is None:
+            suffix = self.SUFFIXES[1] if self.compress else self.SUFFIXES[0]
+        return os.path.join(self.root_dir, relative_path + suffix)
 
-        if os.path.exists(dest_path):
-            raise ValueError('%r must not already exist' % dest_path)
 
-        if dest_path in self.expected_xunit_files:
-            raise ValueError('%r already reserved' % dest_path)
+    def variants(self, dest_path):
+        """the compressed and uncompressed names of a destination path,
+        only itself for the other files"""
+        for suffix in self.SUFFIXES:
+            if dest_path.endswith(suffix):
+                stem = dest_path[:-len(suffix)]
+                return [stem + variant for variant in self.SUFFIXES]
+        return [dest_path]
+
+
+    def make_dir(self, dest_dir):
+        if dest_dir in self.known_dirs:
+            return
 
-        dest_dir = os.path.dirname(dest_path)
         if not os.path.isdir(dest_dir):
             os.makedirs(dest_dir)
+        self.known_dirs.add(dest_dir)
 
-        self.expected_xunit_files.append(dest_path)
+
+    def reserve_file(self, relative_path, suffix=None):
+        """reserve a XML file for the slice at <relative_path>.xml
+        (<relative_path>.xml.gz when compressing)
+
+        - the relative path will be created for you
+        - not writing anything to that file is an error
+        - neither the compressed nor uncompressed file may already exist
+
+        files other than xunit ones, such as split indexes, are reserved
+        with their own suffix.
+        """
+        dest_path = self.destination_path(relative_path, suffix)
+
+        if dest_path in self.expected_xunit_files:
+            raise ValueError('%r already reserved' % dest_path)
+
+        for path in self.variants(dest_path):
+            if os.path.exists(path):
+                raise ValueError('%r must not already exist' % path)
+
+        self.make_dir(os.path.dirname(dest_path))
+        self.expected_xunit_files.add(dest_path)
 
         return dest_path
 
 
+    def reserve_files(self, relative_paths):
+        """reserve many XML files at once, see reserve_file
+
+        each directory is listed once rather than every file being
+        looked up. Nothing is reserved if any of the files cannot be.
+        """
+        dest_paths = [self.destination_path(path) for path in relative_paths]
+
+        reserved = set()
+        for dest_path in dest_paths:
+            if dest_path in self.expected_xunit_files or dest_path in reserved:
+                raise ValueError('%r already reserved' % dest_path)
+            reserved.add(dest_path)
+
+        for dest_dir, paths in group_by_dir(dest_paths).items():
+            existing = list_dir(dest_dir)
+            for dest_path in paths:
+                for path in self.variants(dest_path):
+                    if os.path.basename(path) in existing:
+                        raise ValueError('%r must not already exist' % path)
+
+        for dest_dir in group_by_dir(dest_paths):
+            self.make_dir(dest_dir)
+        self.expected_xunit_files.update(dest_paths)
+
+        return dest_paths
+
+
+    def missing_files(self):
+        """the set of reserved files which have not been produced"""
+        missing = set()
+        for dest_dir, paths in group_by_dir(self.expected_xunit_files).items():
+            files = list_dir(dest_dir, files_only=True)
+            missing.update(
+                path for path in paths if os.path.basename(path) not in files
+            )
+        return missing
+
+
     def check(self):
-        expected = self.expected_xunit_files
-        if not all(os.path.exists(path) for path in expected):
+        missing = self.missing_files()
+        if missing:
             raise Exception(
                 'result files %r reserved by hook have not been produced' % (
-                    set(path for path in expected if not os.path.isfile(path))
+                    missing
             ))
+
+
+class _StreamedFile(object):
+    """a xunit file written one report at a time by a XunitStreamWriter
+
+    compressed files are first written to an uncompressed temporary file,
+    as the writer needs to seek back into its output.
+    """
+
+    def __init__(self, dest_path, suite_name, package_name, time_precision=6):
+        self.dest_path = dest_path
+        self.suite_name = suite_name
+        self.compressed = compression_of(dest_path) is not None
+        if self.compressed:
+            self.file = tempfile.TemporaryFile(dir=os.path.dirname(dest_path))
+        else:
+            self.file = open(dest_path, 'wb')
+        self.writer = XunitStreamWriter(
+            self.file, suite_name, package_name=package_name,
+            time_precision=time_precision)
+
+    def close(self):
+        try:
+            self.writer.close()
+            if self.compressed:
+                self.file.seek(0)
+                with open_output(self.dest_path) as outf:
+                    shutil.copyfileobj(self.file, outf)
+        finally:
+            self.file.close()
+
+    def abort(self):
+        """close the file and remove what was written of it, so that
+        check() reports it as not produced"""
+        self.file.close()
+        if not self.compressed:
+            os.unlink(self.dest_path)
+
+
+def replace_report_file(dest_path, suite_name, reports, package_name=None,
+                        time_precision=6):
+    """atomically (re)write a xunit file: readers see either the previous
+    or the new version, never a partial one"""
+    data = toxml(reports, suite_name, package_name=package_name,
+                 time_precision=time_precision)
+    module = compression_of(dest_path)
+    if module is not None:
+        data = module.compress(data)
+
+    dest_dir, dest_name = os.path.split(dest_path)
+    fd, tmp_path = create_temporary_file(dest_dir, '.%s.' % dest_name)
+    try:
+        with os.fdopen(fd, 'wb') as tmpf:
+            tmpf.write(data)
+        os.replace(tmp_path, dest_path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def create_temporary_file(dest_dir, prefix):
+    """like tempfile.mkstemp, but with the permissions open() would give:
+    mkstemp creates files readable by their owner only"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        path = os.path.join(dest_dir, prefix + os.urandom(6).hex())
+        try:
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            pass
+
+
+def write_report_file(dest_path, suite_name, reports, package_name,
+                      time_precision=6):
+    data = toxml(reports, suite_name, package_name=package_name,
+                 time_precision=time_precision)
+    with open_output(dest_path) as outf:
+        outf.write(data)
+
+
+def group_by_dir(paths):
+    paths_by_dir = {}
+    for path in paths:
+        paths_by_dir.setdefault(os.path.dirname(path), []).append(path)
+    return paths_by_dir
+
+
+def list_dir(path, files_only=False):
+    """the set of names in the directory, empty if it does not exist"""
+    try:
+        with os.scandir(path) as entries:
+            return set(
+                entry.name for entry in entries
+                if not files_only or entry.is_file()
+            )
+    except FileNotFoundError:
+        return set()
@@ -7,100 +7,628 @@ event traces are similar/compatible with those produced by uu.spdr
 https://github.com/uucidl/uu.spdr
 """
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
 
+import io
+import mmap
 import os
 import re
+import struct
+import sys
+import time
 
 from socket import gethostname
 
 from xunitgen import XunitDestination, EventReceiver, toxml
+from xunitgen.disk_writing import replace_report_file
+from xunitgen.binary_traces import (
+    MAGIC as BINARY_MAGIC,
+    BinaryTraceDecoder,
+    convert_tt01,
+    is_binary_trace,
+    iter_binary_traces,
+    read_binary_traces,
+)
+from xunitgen.compression import compression_of, open_input
+
+
+_STRING = r'"((?:[^\\"]|\\.)*)"'
+
+_HEADER_RE = re.compile(
+    r'TT01 ([0-9]+) ([0-9]+) ([0-9]+) ' + _STRING + ' ' + _STRING + r' "([A-Z])"'
+)
+
+_ARG_RE = re.compile(
+    ' ' + _STRING + r' (?:' + _STRING + r'|([0-9]+\.[0-9]*)|([0-9]+))'
+)
+
+_ESCAPE_RE = re.compile(
+    r'\\(?:x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|([0-7]{1,3})|(.))',
+    re.DOTALL,
+)
+
+_SIMPLE_ESCAPES = {
+    'a': '\a',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+    '\\': '\\',
+    '"': '"',
+    "'": "'",
+    '\n': '',
+}
+
+
+def _unescape_match(match):
+    hex2, hex4, hex8, octal, char = match.groups()
+    if char is not None:
+        return _SIMPLE_ESCAPES.get(char, '\\' + char)
+    if octal is not None:
+        return chr(int(octal, 8))
+    return chr(int(hex2 or hex4 or hex8, 16))
+
+
+def _unquote_str(string):
+    """decode the (unquoted) body of a C-style string literal"""
+    if '\\' not in string:
+        return string
+    return _ESCAPE_RE.sub(_unescape_match, string)
 
 
 def parse_trace(line):
-    main_re = r'^TT01 ([0-9]+) ([0-9]+) ([0-9]+) ("(?:[^\\"]|\\.)*") ("(?:[^\\"]|\\.)*") ("[A-Z]")(.*)$'
-    match = re.match(main_re, line)
-    if match:
-        def get(i):
-            return match.group(i)
-
-        def unquote_str(string):
-            return eval(string)
-
-        trace = dict(
-            ts=int(get(1)),
-            pid=int(get(2)),
-            tid=int(get(3)),
-            cat=unquote_str(get(4)),
-            name=unquote_str(get(5)),
-            ph=unquote_str(get(6)),
-            args={},
-        )
-
-        arg_str = get(7)
-        if arg_str:
-            for match in re.finditer(r' ("(?:[^\\"]|\\.)*") ((?:"(?:[^\\"]|\\.)*")|(?:[0-9]+\.[0-9]*)|(?:[0-9]+))', arg_str):
-                name = unquote_str(get(1))
-                value_str = get(2)
-                if re.match(r'^"(?:[^\\"]|\\.)*"$', value_str):
-                    value = unquote_str(value_str)
-                elif re.match(r'^[0-9]+\.[0-9]*$', value_str):
-                    value = float(value_str)
-                elif re.match(r'^[0-9]+$', value_str):
-                    value = int(value_str)
-
-                trace['args'][name] = value
-
-            if not trace['args']:
-                raise Exception('Could not parse args %r' % arg_str)
-
-        return trace
-
-    raise Exception('Could not parse %r' % line)
+    """parse a single TT01 line into a trace dictionary"""
+    match = _HEADER_RE.match(line)
+    if match is None:
+        raise Exception('Could not parse %r' % line)
 
+    ts, pid, tid, cat, name, ph = match.groups()
+    trace = dict(
+        ts=int(ts),
+        pid=int(pid),
+        tid=int(tid),
+        cat=_unquote_str(cat),
+        name=_unquote_str(name),
+        ph=ph,
+        args={},
+    )
 
-def gather_test_results(traces):
-    MICROS_TO_S = 1000000.0
-    receiver = EventReceiver()
+    end = len(line)
+    while end and line[end - 1] in '\r\n':
+        end -= 1
+
+    args = trace['args']
+    pos = match.end()
+    while pos < end:
+        arg_match = _ARG_RE.match(line, pos, end)
+        if arg_match is None:
+            raise Exception('Could not parse args %r' % line[match.end():end])
+
+        key, string_value, float_value, int_value = arg_match.groups()
+        if string_value is not None:
+            value = _unquote_str(string_value)
+        elif float_value is not None:
+            value = float(float_value)
+        else:
+            value = int(int_value)
+
+        args[_unquote_str(key)] = value
+        pos = arg_match.end()
+
+    return trace
+
+
+def _quote_str(string):
+    return '"%s"' % (
+        string.replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def format_trace(trace):
+    """format a trace dictionary as a TT01 line, as parse_trace reads it
+
+    numbers must not be negative, which TT01 cannot represent.
+    """
+    parts = ['TT01 %d %d %d %s %s %s' % (
+        trace['ts'], trace['pid'], trace['tid'], _quote_str(trace['cat']),
+        _quote_str(trace['name']), _quote_str(trace['ph']),
+    )]
+    for key, value in trace['args'].items():
+        if isinstance(value, float):
+            value = repr(value) if 'e' not in repr(value) else '%.17f' % value
+        elif isinstance(value, int):
+            value = '%d' % value
+        else:
+            value = _quote_str(value)
+        if value.startswith('-'):
+            raise ValueError('cannot format negative argument %s' % key)
+        parts.append('%s %s' % (_quote_str(key), value))
+    return ' '.join(parts) + '\n'
+
+
+def parse_lines(lines, filename='<stdin>'):
+    """lazily parse an iterable of TT01 lines into traces"""
+    for line_i, line in enumerate(lines, 1):
+        try:
+            yield parse_trace(line)
+        except Exception as e:
+            raise Exception('%s:%d: error: %r' % (filename, line_i, e))
+
+
+def chunk_ranges(path, chunk_size):
+    """split a file into (start, end) byte ranges of about chunk_size
+    bytes, each ending just after a newline (or at the end of the file)"""
+    ranges = []
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return ranges
+
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                newline = data.find(b'\n', start + max(chunk_size, 1) - 1)
+                end = size if newline < 0 else newline + 1
+                ranges.append((start, end))
+                start = end
+        finally:
+            data.close()
+
+    return ranges
+
+
+def _parse_chunk(path, start, end):
+    """parse the lines in [start, end) of the file.
+
+    returns the number of lines, the traces and the first error as a
+    (chunk relative line number, exception) tuple, or None. The traces
+    are sent back as a TB01 stream, much cheaper to pickle than a list
+    of dictionaries, unless some do not fit its fields.
+    """
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            lines = data[start:end].decode('utf-8').split('\n')
+        finally:
+            data.close()
+
+    if lines[-1] == '':
+        lines.pop()
+
+    traces = []
+    error = None
+    for line_i, line in enumerate(lines):
+        try:
+            traces.append(parse_trace(line))
+        except Exception as e:
+            error = line_i, e
+            break
+
+    encoded = io.BytesIO()
+    try:
+        convert_tt01(traces, encoded)
+    except (ValueError, struct.error):
+        return len(lines), traces, error
+    return len(lines), encoded.getvalue(), error
+
+
+def parse_file_in_parallel(path, jobs, chunk_size=None):
+    """parse a trace log file using a pool of `jobs` processes
+
+    traces are yielded in file order, at most 2 * jobs chunks are in
+    flight at any time. With a single job or a single chunk, the file is
+    parsed in this process, as exchanging chunks would only cost time.
+    """
+    if chunk_size is None:
+        size = os.path.getsize(path)
+        chunk_size = max(1 << 20, size // (jobs * 8))
+
+    ranges = chunk_ranges(path, chunk_size)
+    if jobs <= 1 or len(ranges) <= 1:
+        with open_input(path) as file:
+            for trace in parse_lines(file, path):
+                yield trace
+        return
+
+    ranges = iter(ranges)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+
+        def submit_next():
+            for start, end in ranges:
+                in_flight.append(executor.submit(_parse_chunk, path, start, end))
+                return
+
+        for _ in range(2 * jobs):
+            submit_next()
+
+        lines_before = 0
+        while in_flight:
+            line_count, traces, error = in_flight.popleft().result()
+            submit_next()
+            if isinstance(traces, bytes):
+                traces = BinaryTraceDecoder().decode(traces, len(BINARY_MAGIC))
+            if error is not None:
+                line_i, e = error
+                raise Exception('%s:%d: error: %r' % (
+                    path, lines_before + line_i + 1, e))
+
+            for trace in traces:
+                yield trace
+            lines_before += line_count
+
+
+class TestResultGatherer(object):
+    """turns traces into test reports.
+
+    test runners may emit traces from many processes and threads into
+    the same log, each (pid, tid) pair therefore gets its own
+    EventReceiver so that interleaved cases do not disturb each other.
+    """
+
+    MICROS_TO_NS = 1000
+
+    def __init__(self):
+        self.receivers = {}
+
+    def feed(self, trace):
+        """consume a trace, returns the reports it completed"""
+        if trace['cat'] != 'test':
+            return []
+
+        worker = trace.get('pid'), trace.get('tid')
+        receiver = self.receivers.get(worker)
+        if receiver is None:
+            receiver = self.receivers[worker] = EventReceiver()
+
+        ts_ns = trace['ts'] * self.MICROS_TO_NS
+        current_case = receiver.current_case
+        if trace['ph'] == 'E' and current_case is not None and current_case.name == trace['name']:
+            receiver.end_case_ns(trace['name'], ts_ns)
+        elif trace['ph'] == 'B' and current_case is None:
+            receiver.begin_case_ns(
+                trace['name'], ts_ns, os.path.splitext(
+                    trace['args']['filename'])[0].replace(os.sep, '.')
+            )
+        elif trace['ph'] == 'I' and trace['name'] == 'failure':
+            receiver.failure(trace['args'][
+                             'reason'], trace['args']['lineno'])
+
+        return self._drain(receiver)
+
+    def finish(self):
+        """close any case still in progress, returns the remaining reports"""
+        return [case for worker, case in self.finish_by_worker()]
+
+    def finish_by_worker(self):
+        """like finish, but returns (worker, report) pairs"""
+        results = []
+        for worker, receiver in self.receivers.items():
+            receiver.results()
+            results.extend((worker, case) for case in self._drain(receiver))
+        return results
+
+    def _drain(self, receiver):
+        if not receiver.cases:
+            return []
+        reports = receiver.cases
+        receiver.cases = []
+        return reports
+
+
+def iter_worker_results(traces):
+    """yield (worker, report) pairs as soon as their case has been closed,
+    the worker being the (pid, tid) pair which traced the case"""
+    gatherer = TestResultGatherer()
 
     for trace in traces:
-        ts_seconds = trace['ts'] / MICROS_TO_S
-        if trace['cat'] == 'test':
-            if trace['ph'] == 'E' and receiver.current_case.name == trace['name']:
-                receiver.end_case(trace['name'], ts_seconds)
-            elif trace['ph'] == 'B' and receiver.current_case is None:
-                receiver.begin_case(
-                    trace['name'], ts_seconds, os.path.splitext(
-                        trace['args']['filename'])[0].replace(os.sep, '.')
-                )
-            elif trace['ph'] == 'I' and trace['name'] == 'failure':
-                receiver.failure(trace['args'][
-                                 'reason'], trace['args']['lineno'])
-
-    return receiver.results()
+        completed = gatherer.feed(trace)
+        if completed:
+            worker = trace.get('pid'), trace.get('tid')
+            for case in completed:
+                yield worker, case
+
+    for worker, case in gatherer.finish_by_worker():
+        yield worker, case
+
+
+def iter_test_results(traces):
+    """yield test reports as soon as their case has been closed
+
+    only the cases in progress are held in memory.
+    """
+    for worker, case in iter_worker_results(traces):
+        yield case
+
+
+def gather_test_results(traces):
+    return list(iter_test_results(traces))
+
+
+def gather_test_results_by_worker(traces):
+    """gather test reports into one list per (pid, tid) worker"""
+    reports = {}
+    for worker, case in iter_worker_results(traces):
+        reports.setdefault(worker, []).append(case)
+    return reports
+
+
+@contextmanager
+def open_traces(src_trace_log, jobs=1):
+    """open a trace log and provide an iterator over its traces
+
+    the log may be in the TT01 or TB01 format, possibly compressed, and
+    is read from stdin if src_trace_log is -. Uncompressed TT01 logs are
+    parsed with `jobs` processes.
+    """
+    if src_trace_log == '-':
+        stdin = sys.stdin.buffer
+        if is_binary_trace(stdin.peek(len(BINARY_MAGIC))[:len(BINARY_MAGIC)]):
+            yield read_binary_traces(stdin)
+        else:
+            with open_input(stdin) as file:
+                yield parse_lines(file, '<stdin>')
+        return
+
+    with open(src_trace_log, 'rb') as file:
+        head = file.read(8)
+
+    if is_binary_trace(head):
+        yield iter_binary_traces(src_trace_log)
+    elif compression_of(src_trace_log, head) is None and jobs > 1:
+        yield parse_file_in_parallel(src_trace_log, jobs)
+    else:
+        with open_input(src_trace_log) as file:
+            yield parse_lines(file, src_trace_log)
+
+
+class TraceFollower(object):
+    """incrementally converts a TT01 log which is still being written
+
+    every poll() parses the complete lines appended since the previous
+    one, a partially written last line is kept until it is completed.
+    """
+
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, path, digest=None):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.pending = b''
+        self.line_count = 0
+        self.gatherer = TestResultGatherer()
+        self.reports = []
+        # when set, updated with the bytes of every parsed line
+        self.digest = digest
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def offset(self):
+        """the position just after the last complete line parsed"""
+        return self.file.tell() - len(self.pending)
+
+    def poll(self):
+        """parse newly appended lines, returns the number of new reports"""
+        count = 0
+        while True:
+            data = self.file.read(self.BLOCK_SIZE)
+            if not data:
+                return count
+
+            data = self.pending + data
+            end = data.rfind(b'\n') + 1
+            self.pending = data[end:]
+            if self.digest is not None:
+                self.digest.update(data[:end])
+            count += self._parse(data[:end].decode('utf-8').split('\n')[:-1])
+
+    def finish(self, parse_pending=True):
+        """parse what remains and close the cases still in progress
+
+        unless parse_pending is set, a last line missing its end of line
+        is considered as still being written, and ignored.
+        """
+        self.poll()
+        count = 0
+        if self.pending and parse_pending:
+            count = self._parse([self.pending.decode('utf-8')])
+            self.pending = b''
+
+        finished = self.gatherer.finish()
+        self.reports.extend(finished)
+        return count + len(finished)
+
+    def _parse(self, lines):
+        count = len(self.reports)
+        for line in lines:
+            self.line_count += 1
+            try:
+                trace = parse_trace(line)
+            except Exception as e:
+                raise Exception('%s:%d: error: %r' % (self.path, self.line_count, e))
+            self.reports.extend(self.gatherer.feed(trace))
+        return len(self.reports) - count
+
+
+def follow(src_trace_log, dst_xunit_file, interval, idle_timeout=None,
+           poll_interval=0.25, clock=time.monotonic, sleep=time.sleep):
+    """convert a growing trace log, rewriting the xunit file every
+    `interval` seconds with the cases completed so far.
+
+    stops once the log has not grown for `idle_timeout` seconds, or when
+    interrupted; the cases still in progress are then closed.
+    """
+    follower = TraceFollower(src_trace_log)
+    written_count = 0
+    last_write = last_growth = clock()
+    try:
+        while True:
+            position = follower.file.tell()
+            follower.poll()
+            if follower.file.tell() != position:
+                last_growth = clock()
+
+            now = clock()
+            if now - last_write >= interval and len(follower.reports) != written_count:
+                replace_report_file(dst_xunit_file, 'testsuite', follower.reports)
+                written_count = len(follower.reports)
+                last_write = now
+
+            if idle_timeout is not None and now - last_growth >= idle_timeout:
+                break
+            sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+    # a last line without its end of line is still being written
+    try:
+        follower.finish(parse_pending=False)
+    finally:
+        follower.close()
+    if follower.reports:
+        replace_report_file(dst_xunit_file, 'testsuite', follower.reports)
+
+
+def _checked(results, checker):
+    """pass (worker, report) pairs through a RegressionChecker"""
+    for worker, report in results:
+        checker.check('testsuite', report)
+        yield worker, report
+
+
+def _exported(results, trace_writer):
+    """pass (worker, report) pairs through a ChromeTraceWriter, which is
+    closed even if the conversion fails part way"""
+    try:
+        for worker, report in results:
+            trace_writer.write(report, worker)
+            yield worker, report
+    finally:
+        trace_writer.close()
 
 
 def main():
     parser = ArgumentParser()
-    parser.add_argument("dst_xunit_file")
-    parser.add_argument("src_trace_log")
+    parser.add_argument(
+        "dst_xunit_file",
+        help="xunit file to produce, compressed with gzip if it ends in .gz",
+    )
+    parser.add_argument(
+        "src_trace_log", nargs="?", default="-",
+        help="trace log (TT01 or TB01) to convert, or - (the default) to "
+        "read from stdin. gzip, bz2 and xz logs are decompressed on the fly",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="parse the trace log using N processes (compressed logs are "
+        "always parsed serially)",
+    )
+
+    parser.add_argument(
+        "--follow", action="store_true",
+        help="keep converting the trace log as it grows, until interrupted",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10.0, metavar="SECONDS",
+        help="with --follow, how often to rewrite the xunit file",
+    )
+    parser.add_argument(
+        "--idle-timeout", type=float, default=None, metavar="SECONDS",
+        help="with --follow, stop once the log has not grown for that long",
+    )
+
+    parser.add_argument(
+        "--checkpoint", metavar="PATH",
+        help="resume converting an append-only TT01 log from the checkpoint "
+        "at PATH, which is then updated",
+    )
+
+    parser.add_argument(
+        "--chrome-trace", metavar="PATH",
+        help="also export the test cases as a Chrome trace-event timeline, "
+        "for Perfetto or about:tracing",
+    )
+
+    from xunitgen import regressions
+    regressions.add_arguments(parser)
 
     args = parser.parse_args()
+    checker = None
+    if args.baseline:
+        if args.follow:
+            parser.error('--baseline cannot be used with --follow')
+        history = regressions.DurationHistory()
+        for path in args.baseline:
+            history.load(path)
+        checker = regressions.checker_from_arguments(args, history)
+        if checker is None:
+            parser.error('--baseline requires --max-ratio, --max-increase or --percentile')
 
-    destination = XunitDestination(os.path.dirname(os.path.abspath(args.dst_xunit_file)))
-    xml_filepath = os.path.splitext(os.path.basename(args.dst_xunit_file))[0]
-    with open(args.src_trace_log) as file:
-        def parse_line(line_i, line):
-            try:
-                return parse_trace(line)
-            except Exception as e:
-                raise Exception('%s:%d: error: %r' % (
-                    args.src_trace_log, i, e))
+    if args.checkpoint is not None:
+        if args.src_trace_log == '-' or args.follow:
+            parser.error('--checkpoint requires a trace log file, without --follow')
+        with open(args.src_trace_log, 'rb') as file:
+            head = file.read(8)
+        if is_binary_trace(head) or compression_of(args.src_trace_log, head):
+            parser.error('--checkpoint requires an uncompressed TT01 trace log')
+
+    if args.follow:
+        if args.chrome_trace is not None:
+            parser.error('--chrome-trace cannot be used with --follow')
+        if args.src_trace_log == '-':
+            parser.error('--follow requires a trace log file')
+        follow(args.src_trace_log, args.dst_xunit_file, args.interval,
+               idle_timeout=args.idle_timeout)
+        return
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.jobs > 1 and args.src_trace_log == '-':
+        parser.error('--jobs requires a trace log file')
+
+    dst_dir, dst_name = os.path.split(os.path.abspath(args.dst_xunit_file))
+    compress = dst_name.endswith('.gz')
+    if compress:
+        dst_name = dst_name[:-len('.gz')]
+    destination = XunitDestination(dst_dir, compress=compress)
+    xml_filepath = os.path.splitext(dst_name)[0]
+
+    with ExitStack() as stack:
+        if args.checkpoint is not None:
+            from xunitgen.checkpoints import convert_incrementally
+            results = (
+                (None, case) for case in
+                convert_incrementally(args.src_trace_log, args.checkpoint)
+            )
+        else:
+            traces = stack.enter_context(open_traces(args.src_trace_log, jobs=args.jobs))
+            results = iter_worker_results(traces)
+
+        # regressions are marked as failures before being exported
+        if checker is not None:
+            results = _checked(results, checker)
+        if args.chrome_trace is not None:
+            from xunitgen.chrome_traces import ChromeTraceWriter
+            trace_writer = ChromeTraceWriter(
+                stack.enter_context(open(args.chrome_trace, 'w')))
+            results = stack.enter_context(closing(_exported(results, trace_writer)))
 
-        test_results = gather_test_results(
-            [parse_line(i, line) for i, line in enumerate(file.readlines())]
-        )
+        destination.stream_reports(
+            xml_filepath, 'testsuite', (case for worker, case in results))
 
-    destination.write_reports(xml_filepath, 'testsuite', test_results)
+    if checker is not None:
+        sys.stderr.write(checker.format_summaries() + '\n')
+    if args.chrome_trace is not None:
+        from xunitgen.chrome_traces import format_statistics
+        sys.stderr.write(format_statistics(trace_writer.statistics()) + '\n')
 
 
 if __name__ == "__main__":
@@ -1,21 +1,104 @@
 """convert test events to a xunit XML file"""
 
-from xml.etree import ElementTree as et
 
+from array import array
 from datetime import datetime
+from decimal import Decimal
 from socket import gethostname
 
+import math
+import re
+import time
+
+NANOS_PER_SECOND = 1000000000
+
+# time.time_ns() when time.perf_counter_ns() was 0, sampled once so that
+# recorded durations never suffer from wall-clock adjustments
+_WALL_CLOCK_ANCHOR_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def clock_ns():
+    """the current time in integer nanoseconds since the epoch, measured
+    with the high resolution monotonic clock"""
+    return _WALL_CLOCK_ANCHOR_NS + time.perf_counter_ns()
+
+
+def seconds_to_ns(seconds):
+    if seconds is None or isinstance(seconds, int):
+        return None if seconds is None else seconds * NANOS_PER_SECOND
+    whole = math.floor(seconds)
+    return int(whole) * NANOS_PER_SECOND + int(round((seconds - whole) * NANOS_PER_SECOND))
+
+
+def parse_seconds(text):
+    """the nanoseconds in a decimal number of seconds, without going
+    through a float"""
+    return int((Decimal(text) * NANOS_PER_SECOND).to_integral_value())
+
+
+def format_seconds(ns, precision=6):
+    """format a duration in nanoseconds as decimal seconds, rounded to
+    `precision` (0 to 9) digits"""
+    if not 0 <= precision <= 9:
+        raise ValueError('precision must be between 0 and 9, not %r' % precision)
+    sign = '-' if ns < 0 else ''
+    quantum = 10 ** (9 - precision)
+    units = (abs(ns) + quantum // 2) // quantum
+    if precision == 0:
+        return '%s%d' % (sign, units)
+    scale = 10 ** precision
+    return '%s%d.%0*d' % (sign, units // scale, precision, units % scale)
+
+
+def format_timestamp(ns):
+    """the local date and time of an epoch timestamp in nanoseconds, to
+    the second as the xunit schema requires"""
+    return datetime.fromtimestamp(ns // NANOS_PER_SECOND).isoformat()
+
 
 class Report(object):
-    """represents a test case report"""
+    """represents a test case report
 
-    def __init__(self, name, start_ts=None, end_ts=None, src_location=None):
+    times are kept as integer nanoseconds since the epoch (start_ns,
+    end_ns). start_ts and end_ts present them in seconds.
+    """
+
+    __slots__ = (
+        'name', 'start_ns', 'end_ns', 'src_location', 'failures', 'errors',
+        'properties', 'system_out',
+    )
+
+    def __init__(self, name, start_ts=None, end_ts=None, src_location=None,
+                 start_ns=None, end_ns=None):
         self.name = name
-        self.start_ts = start_ts
-        self.end_ts = end_ts
+        self.start_ns = start_ns if start_ns is not None else seconds_to_ns(start_ts)
+        self.end_ns = end_ns if end_ns is not None else seconds_to_ns(end_ts)
         self.src_location = src_location
         self.failures = []
         self.errors = []
+        # optional (name, value) pairs and captured output
+        self.properties = None
+        self.system_out = None
+
+    @property
+    def start_ts(self):
+        return None if self.start_ns is None else self.start_ns / float(NANOS_PER_SECOND)
+
+    @start_ts.setter
+    def start_ts(self, seconds):
+        self.start_ns = seconds_to_ns(seconds)
+
+    @property
+    def end_ts(self):
+        return None if self.end_ns is None else self.end_ns / float(NANOS_PER_SECOND)
+
+    @end_ts.setter
+    def end_ts(self, seconds):
+        self.end_ns = seconds_to_ns(seconds)
+
+    @property
+    def duration_ns(self):
+        return self.end_ns - self.start_ns
 
     def __repr__(self):
         return '%r' % dict(
@@ -26,125 +109,498 @@ class Report(object):
             src_location=self.src_location,
         )
 
+    def _key(self):
+        return (
+            self.name, self.start_ns, self.end_ns, not self.errors,
+            self.src_location,
+        )
+
     def __hash__(self):
-        return repr(self).__hash__()
+        return hash(self._key())
 
     def __eq__(self, another):
-        return repr(self) == repr(another)
+        if not isinstance(another, Report):
+            return NotImplemented
+        return self._key() == another._key()
+
+    def __ne__(self, another):
+        equal = self.__eq__(another)
+        return equal if equal is NotImplemented else not equal
+
+
+class ReportBatch(object):
+    """a compact, column oriented collection of test reports
+
+    names are stored as utf-8 in a single buffer, timestamps in arrays
+    and source locations are interned. Failures and errors, which are
+    the exception, are kept aside per row.
+
+    Indexing or iterating creates Report objects on the fly: modifying
+    them does not modify the batch. A batch can be passed to toxml.
+    """
+
+    def __init__(self, reports=()):
+        self.name_data = bytearray()
+        self.name_offsets = array('Q', [0])
+        self.start_ns = array('q')
+        self.end_ns = array('q')
+        self.location_ids = array('L')
+        self.locations = []
+        self.location_index = {}
+        self.failures = {}
+        self.errors = {}
+        self.properties = {}
+        self.system_out = {}
+
+        for report in reports:
+            self.append(report)
+
+    def add(self, name, start_ts, end_ts, src_location=None,
+            failures=(), errors=(), properties=None, system_out=None):
+        self.add_ns(
+            name, seconds_to_ns(start_ts), seconds_to_ns(end_ts), src_location,
+            failures, errors, properties, system_out,
+        )
+
+    def add_ns(self, name, start_ns, end_ns, src_location=None,
+               failures=(), errors=(), properties=None, system_out=None):
+        """add, with timestamps in integer nanoseconds"""
+        row = len(self.start_ns)
+
+        self.name_data += name.encode('utf-8')
+        self.name_offsets.append(len(self.name_data))
+        self.start_ns.append(start_ns)
+        self.end_ns.append(end_ns)
+
+        location_id = self.location_index.get(src_location)
+        if location_id is None:
+            location_id = self.location_index[src_location] = len(self.locations)
+            self.locations.append(src_location)
+        self.location_ids.append(location_id)
+
+        if failures:
+            self.failures[row] = list(failures)
+        if errors:
+            self.errors[row] = list(errors)
+        if properties:
+            self.properties[row] = list(properties)
+        if system_out:
+            self.system_out[row] = system_out
+
+    def append(self, report):
+        self.add_ns(
+            report.name, report.start_ns, report.end_ns, report.src_location,
+            report.failures, report.errors, report.properties,
+            report.system_out,
+        )
+
+    def __len__(self):
+        return len(self.start_ns)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('report index out of range')
+
+        name = self.name_data[
+            self.name_offsets[row]:self.name_offsets[row + 1]
+        ].decode('utf-8')
+        report = Report(
+            name,
+            src_location=self.locations[self.location_ids[row]],
+            start_ns=self.start_ns[row],
+            end_ns=self.end_ns[row],
+        )
+        report.failures.extend(self.failures.get(row, ()))
+        report.errors.extend(self.errors.get(row, ()))
+        report.properties = self.properties.get(row)
+        report.system_out = self.system_out.get(row)
+        return report
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
 
 
 class EventReceiver(object):
-    """eventfull interface to collect results from test cases and produce test reports."""
+    """eventfull interface to collect results from test cases and produce test reports.
+
+    identical messages are shared between cases, up to max_messages
+    distinct ones. Each case keeps at most max_messages failures and
+    errors of at most max_message_size characters, the messages dropped
+    past that are counted in a last one.
+    """
 
-    def __init__(self):
+    def __init__(self, max_messages=100, max_message_size=4096):
         self.cases = []
         self.current_case = None
-
-    def end_current_case(self, ts):
-        self.current_case.end_ts = ts
-        self.cases.append(self.current_case)
+        self.max_messages = max_messages
+        self.max_message_size = max_message_size
+        self.dropped_failures = 0
+        self.dropped_errors = 0
+        self.shared_messages = {}
+
+    def end_current_case(self, ts_ns):
+        case = self.current_case
+        if self.dropped_failures:
+            case.failures.append('(%d more failures dropped)' % self.dropped_failures)
+        if self.dropped_errors:
+            case.errors.append('(%d more errors dropped)' % self.dropped_errors)
+        self.dropped_failures = self.dropped_errors = 0
+
+        case.end_ns = ts_ns
+        self.cases.append(case)
+
+    def add_message(self, messages, message):
+        """append a message, returns False if it had to be dropped"""
+        if len(messages) >= self.max_messages:
+            return False
+        if len(message) > self.max_message_size:
+            message = '%s... (%d characters dropped)' % (
+                message[:self.max_message_size], len(message) - self.max_message_size)
+        shared = self.shared_messages.get(message)
+        if shared is None:
+            # not sys.intern: interned strings are never freed from Python 3.12
+            if len(self.shared_messages) < self.max_messages:
+                self.shared_messages[message] = message
+            shared = message
+        messages.append(shared)
+        return True
 
     def begin_case(self, test_name, ts, src_location):
+        self.begin_case_ns(test_name, seconds_to_ns(ts), src_location)
+
+    def begin_case_ns(self, test_name, ts_ns, src_location):
+        """begin_case, with a timestamp in integer nanoseconds"""
         if self.current_case is not None:
-            self.error(ts)
-            self.end_current_case(ts)
+            self.error(format_seconds(ts_ns))
+            self.end_current_case(ts_ns)
 
         self.current_case = Report(test_name)
-        self.current_case.start_ts = ts
+        self.current_case.start_ns = ts_ns
         self.current_case.src_location = src_location
 
     def end_case(self, test_name, ts):
+        self.end_case_ns(test_name, seconds_to_ns(ts))
+
+    def end_case_ns(self, test_name, ts_ns):
+        """end_case, with a timestamp in integer nanoseconds"""
         if self.current_case is None or self.current_case.name != test_name:
             raise Exception(
                 'cannot close case %s (current: %s)' % (test_name, self.current_case)
             )
-        self.end_current_case(ts)
+        self.end_current_case(ts_ns)
         self.current_case = None
 
     def error(self, reason):
         assert self.current_case is not None
-        self.current_case.errors.append(
-            'error %s' % (
+        if not self.add_message(self.current_case.errors, 'error %s' % (
                 reason
-            )
-        )
+        )):
+            self.dropped_errors += 1
 
     def failure(self, reason, src_location):
         assert self.current_case is not None
-        self.current_case.failures.append(
-            'test failure %s at %s' % (
+        if not self.add_message(self.current_case.failures, 'test failure %s at %s' % (
                 reason, src_location,
-            )
-        )
+        )):
+            self.dropped_failures += 1
 
     def results(self):
         if self.current_case is not None:
             self.error('test finished unexpectedly')
-            self.end_current_case(self.current_case.start_ts)
+            self.end_current_case(self.current_case.start_ns)
 
         return self.cases
 
 
+def _quote_attribute(value):
+    return value if value is not None else "(null)"
+
+
+def _escape_attribute(value):
+    """escape an attribute value the same way ElementTree does"""
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    if "\"" in value:
+        value = value.replace("\"", "&quot;")
+    if "\r" in value:
+        value = value.replace("\r", "&#13;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#09;")
+    return value
+
+
+def _testsuite_attributes(error_count, failure_count, test_count, hostname,
+                         start_timestamp, total_duration, suite_name,
+                         package_name):
+    """total_duration is already formatted"""
+    return dict(
+        id="0",
+        errors=str(error_count),
+        failures=str(failure_count),
+        tests=str(test_count),
+        hostname=_quote_attribute(hostname),
+        timestamp=_quote_attribute(start_timestamp),
+        time=total_duration,
+        name=_quote_attribute(suite_name),
+        package=_quote_attribute(package_name),
+    )
+
+
+_ATTRIBUTE_SPECIALS = re.compile('[&<>"\r\n\t]')
+_TEXT_SPECIALS = re.compile('[&<>]')
+
+
+def _attribute_bytes(value):
+    if _ATTRIBUTE_SPECIALS.search(value) is not None:
+        value = _escape_attribute(value)
+    return value.encode('utf-8', 'xmlcharrefreplace')
+
+
+def _text_bytes(value):
+    if _TEXT_SPECIALS.search(value) is not None:
+        value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return value.encode('utf-8', 'xmlcharrefreplace')
+
+
+class TestcaseSerializer(object):
+    """writes <testcase> elements straight to utf-8 bytes, byte for byte
+    as ElementTree would, without building elements.
+
+    values which repeat from one test case to the next (classnames,
+    property names) are escaped once and cached.
+    """
+
+    MAX_CACHED = 4096
+
+    def __init__(self, time_precision=6):
+        self.time_precision = time_precision
+        self.cache = {}
+
+
+    def cached(self, value):
+        """the escaped bytes of a repeated attribute value"""
+        data = self.cache.get(value)
+        if data is None:
+            if len(self.cache) >= self.MAX_CACHED:
+                self.cache.clear()
+            data = self.cache[value] = _attribute_bytes(value)
+        return data
+
+
+    def serialize(self, report):
+        r = report
+        parts = [
+            b'<testcase name="', _attribute_bytes(r.name),
+            b'" classname="', self.cached(_quote_attribute(r.src_location)),
+            b'" time="', format_seconds(r.end_ns - r.start_ns, self.time_precision).encode('ascii'),
+            b'"',
+        ]
+        if not (r.properties or r.errors or r.failures or r.system_out):
+            parts.append(b' />')
+            return b''.join(parts)
+
+        parts.append(b'>')
+        if r.properties:
+            parts.append(b'<properties>')
+            for name, value in r.properties:
+                parts += [
+                    b'<property name="', self.cached(name),
+                    b'" value="', _attribute_bytes('%s' % value), b'" />',
+                ]
+            parts.append(b'</properties>')
+        if r.failures or r.errors:
+            tag, messages = (b'failure', r.failures) if r.failures else (b'error', r.errors)
+            parts += [
+                b'<', tag, b' type="exception" message="',
+                _attribute_bytes(_quote_attribute('\n'.join(['%s' % e for e in messages]))),
+                b'" />',
+            ]
+        if r.system_out:
+            parts += [b'<system-out>', _text_bytes(r.system_out), b'</system-out>']
+        parts.append(b'</testcase>')
+        return b''.join(parts)
+
+
+def _testsuite_start_tag(attributes):
+    return ('<testsuite%s>' % ''.join(
+        ' %s="%s"' % (k, _escape_attribute(v))
+        for k, v in attributes.items()
+    )).encode('utf-8', 'xmlcharrefreplace')
+
+
 def toxml(test_reports, suite_name,
-          hostname=gethostname(), package_name="tests"):
-    """convert test reports into an xml file"""
+          hostname=gethostname(), package_name="tests", time_precision=6):
+    """convert test reports into an xml file
 
-    testsuites = et.Element("testsuites")
-    testsuite = et.SubElement(testsuites, "testsuite")
+    times are written in seconds with time_precision decimals (up to 9)
+    """
 
     test_count = len(test_reports)
     if test_count < 1:
         raise ValueError('there must be at least one test report')
 
-
-    assert test_count > 0, 'expecting at least one test'
-
     error_count = len([r for r in test_reports if r.errors])
     failure_count = len([r for r in test_reports if r.failures])
-    ts = test_reports[0].start_ts
-    start_timestamp = datetime.fromtimestamp(ts).isoformat()
+    ts = min(r.start_ns for r in test_reports)
+    start_timestamp = format_timestamp(ts)
+
+    total_duration = format_seconds(
+        max(r.end_ns for r in test_reports) - ts, time_precision)
+
+    serializer = TestcaseSerializer(time_precision)
+    parts = [b'<testsuites>', _testsuite_start_tag(_testsuite_attributes(
+        error_count, failure_count, test_count, hostname, start_timestamp,
+        total_duration, suite_name, package_name,
+    ))]
+    parts.extend(serializer.serialize(r) for r in test_reports)
+    parts.append(b'</testsuite></testsuites>')
+    return b''.join(parts)
+
+
+class XunitStreamWriter(object):
+    """writes a xunit file one test report at a time, in bounded memory.
+
+    The <testsuite> start tag carries totals which are only known once
+    every report has been seen. A fixed-width blank area is reserved in
+    its place and patched by close(), which is why `outf` must be a
+    seekable binary file.
+    """
+
+    # widest values the patched attributes may take
+    MAX_COUNT = 10 ** 20 - 1
+    MAX_TIMESTAMP = '9999-12-31T23:59:59'
+    MAX_DURATION_NS = -10 ** 36
+
+    def __init__(self, outf, suite_name,
+                 hostname=gethostname(), package_name="tests",
+                 time_precision=6):
+        if not outf.seekable():
+            raise ValueError('%r must be seekable' % outf)
+
+        self.outf = outf
+        self.suite_name = suite_name
+        self.hostname = hostname
+        self.package_name = package_name
+        self.time_precision = time_precision
+        self.serializer = TestcaseSerializer(time_precision)
+
+        self.test_count = 0
+        self.error_count = 0
+        self.failure_count = 0
+        self.start_ns = None
+        self.end_ns = None
+
+        self.outf.write(b'<testsuites>')
+        self.header_pos = self.outf.tell()
+        self.header_size = len(self._start_tag(
+            self.MAX_COUNT, self.MAX_COUNT, self.MAX_COUNT,
+            self.MAX_TIMESTAMP, self.MAX_DURATION_NS,
+        ))
+        self.outf.write(b' ' * self.header_size)
+        # bytes in the document once closed
+        self.size = len(b'<testsuites>') + self.header_size + len(self.TRAILER)
+
+
+    def _start_tag(self, error_count, failure_count, test_count,
+                   start_timestamp, total_duration_ns):
+        attributes = _testsuite_attributes(
+            error_count, failure_count, test_count, self.hostname,
+            start_timestamp,
+            format_seconds(total_duration_ns, self.time_precision),
+            self.suite_name, self.package_name,
+        )
+        return _testsuite_start_tag(attributes)
 
-    total_duration = test_reports[-1].end_ts - test_reports[0].start_ts
 
-    def quote_attribute(value):
-        return value if value is not None else "(null)"
+    TRAILER = b'</testsuite></testsuites>'
 
+    def serialize(self, report):
+        """the bytes write() would append for the report"""
+        return self.serializer.serialize(report)
 
-    testsuite.attrib = dict(
-        id="0",
-        errors=str(error_count),
-        failures=str(failure_count),
-        tests=str(test_count),
-        hostname=quote_attribute(hostname),
-        timestamp=quote_attribute(start_timestamp),
-        time="%f" % total_duration,
-        name=quote_attribute(suite_name),
-        package=quote_attribute(package_name),
-    )
 
+    def write(self, report, data=None):
+        """append a test report, returns the number of bytes written
+
+        data, when given, must be serialize(report)
+        """
+        self.test_count += 1
+        if report.errors:
+            self.error_count += 1
+        if report.failures:
+            self.failure_count += 1
+        self.cover(report.start_ns, report.end_ns)
+
+        if data is None:
+            data = self.serialize(report)
+        self.outf.write(data)
+        self.size += len(data)
+        return len(data)
+
+
+    def cover(self, start_ns, end_ns):
+        """widen the suite's timestamp and time to include that span"""
+        if self.start_ns is None or start_ns < self.start_ns:
+            self.start_ns = start_ns
+        if self.end_ns is None or end_ns > self.end_ns:
+            self.end_ns = end_ns
+
+
+    def close(self):
+        """terminate the document and patch in the suite totals"""
+        if self.test_count < 1:
+            raise ValueError('there must be at least one test report')
+
+        self.outf.write(self.TRAILER)
+        end_pos = self.outf.tell()
+
+        start_tag = self._start_tag(
+            self.error_count, self.failure_count, self.test_count,
+            format_timestamp(self.start_ns),
+            self.end_ns - self.start_ns,
+        )
+        if len(start_tag) > self.header_size:
+            raise ValueError('testsuite header overflows its reserved space')
+
+        self.outf.seek(self.header_pos)
+        self.outf.write(start_tag)
+        self.outf.seek(end_pos)
+
+
+def stream_xml(test_reports, outf, suite_name,
+               hostname=gethostname(), package_name="tests",
+               time_precision=6, spans=()):
+    """write an iterable of test reports as xunit into a seekable binary
+    file, without holding more than one report at a time.
+
+    the suite also covers the (start_ns, end_ns) spans, which are read
+    once every report has been written.
+
+    returns the number of test reports written
+    """
+    test_reports = iter(test_reports)
+    first_report = next(test_reports, None)
+    if first_report is None:
+        raise ValueError('there must be at least one test report')
+
+    writer = XunitStreamWriter(
+        outf, suite_name, hostname=hostname, package_name=package_name,
+        time_precision=time_precision,
+    )
+    writer.write(first_report)
     for r in test_reports:
-        test_name = r.name
-        test_duration = r.end_ts - r.start_ts
-        class_name = r.src_location
-
-        testcase = et.SubElement(testsuite, "testcase")
-        testcase.attrib = dict(
-            name=test_name,
-            classname=quote_attribute(class_name),
-            time="%f" % test_duration,
-            )
-        if r.errors or r.failures:
-            if r.failures:
-                failure = et.SubElement(testcase, "failure")
-                failure.attrib = dict(
-                    type="exception",
-                    message=quote_attribute('\n'.join(['%s' % e for e in r.failures])),
-                )
-            else:
-                error = et.SubElement(testcase, "error")
-                error.attrib = dict(
-                    type="exception",
-                    message=quote_attribute('\n'.join(['%s' % e for e in r.errors])),
-                )
-
-    return et.tostring(testsuites, encoding="utf-8")
+        writer.write(r)
+    for start_ns, end_ns in spans:
+        writer.cover(start_ns, end_ns)
+    writer.close()
+
+    return writer.test_count
@@ -0,0 +1,161 @@
+"""merge many xunit files into a single test suite
+
+the inputs are read with iterparse, so that only one test case of each
+file is held in memory at any time. xunit files only record the start of
+their suites: the test cases of a suite are assumed to have run one
+after the other from that point on.
+"""
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from xml.etree import ElementTree as et
+
+import os
+
+from .compression import open_binary_input
+from .disk_writing import XunitDestination
+from .main import Report, parse_seconds, seconds_to_ns, stream_xml
+
+from socket import gethostname
+
+
+def _messages(testcase, tag):
+    element = testcase.find(tag)
+    if element is None:
+        return []
+    return element.get('message', '').split('\n')
+
+
+def iter_xunit_reports(path, spans=None):
+    """yield Reports rebuilt from the test cases of a (possibly
+    compressed) xunit file
+
+    the (start_ns, end_ns) span of each suite, from its timestamp and
+    time, is appended to the spans list when given.
+    """
+    with open_binary_input(path) as inf:
+        testsuite = None
+        start_ns = 0
+        for event, element in et.iterparse(inf, events=('start', 'end')):
+            if element.tag == 'testsuite':
+                if event == 'start':
+                    testsuite = element
+                    timestamp = element.get('timestamp')
+                    start_ns = seconds_to_ns(
+                        datetime.fromisoformat(timestamp).timestamp()) if timestamp else 0
+                    if spans is not None and timestamp:
+                        spans.append((
+                            start_ns, start_ns + parse_seconds(element.get('time', '0'))))
+                else:
+                    element.clear()
+
+            elif element.tag == 'testcase' and event == 'end':
+                duration_ns = parse_seconds(element.get('time', '0'))
+                report = Report(
+                    element.get('name'), src_location=element.get('classname'),
+                    start_ns=start_ns, end_ns=start_ns + duration_ns,
+                )
+                report.failures.extend(_messages(element, 'failure'))
+                report.errors.extend(_messages(element, 'error'))
+                properties = element.find('properties')
+                if properties is not None:
+                    report.properties = [
+                        (prop.get('name'), prop.get('value'))
+                        for prop in properties.iter('property')
+                    ]
+                report.system_out = element.findtext('system-out')
+                start_ns += duration_ns
+
+                if testsuite is not None:
+                    testsuite.remove(element)
+                yield report
+
+
+def load_xunit_reports(path):
+    return list(iter_xunit_reports(path))
+
+
+def _load_xunit_file(path):
+    spans = []
+    return list(iter_xunit_reports(path, spans)), spans
+
+
+def iter_merged_reports(paths, jobs=1, spans=None):
+    """yield the reports of all the xunit files, in order
+
+    with jobs > 1, files are parsed by a pool of processes and only the
+    reports of up to 2 * jobs files are held in memory at once. The spans
+    of their suites are appended to spans, see iter_xunit_reports.
+    """
+    if jobs <= 1:
+        for path in paths:
+            for report in iter_xunit_reports(path, spans):
+                yield report
+        return
+
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+
+        def submit_next():
+            for path in paths:
+                in_flight.append(executor.submit(_load_xunit_file, path))
+                return
+
+        for _ in range(2 * jobs):
+            submit_next()
+
+        while in_flight:
+            reports, file_spans = in_flight.popleft().result()
+            if spans is not None:
+                spans.extend(file_spans)
+            submit_next()
+            for report in reports:
+                yield report
+
+
+def merge_xunit_files(paths, outf, suite_name, jobs=1,
+                      hostname=gethostname(), package_name="tests"):
+    """write the test cases of many xunit files as one suite into a
+    seekable binary file, returns the number of test cases
+
+    the merged suite covers the whole span of the input suites.
+    """
+    spans = []
+    return stream_xml(
+        iter_merged_reports(paths, jobs=jobs, spans=spans), outf, suite_name,
+        hostname=hostname, package_name=package_name, spans=spans,
+    )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "dst_xunit_file",
+        help="xunit file to produce, compressed with gzip if it ends in .gz",
+    )
+    parser.add_argument("src_xunit_files", nargs="+")
+    parser.add_argument("--suite-name", default="testsuite")
+    parser.add_argument("--package-name", default=None)
+    parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="parse the input files using N processes",
+    )
+    args = parser.parse_args()
+
+    dst_dir, dst_name = os.path.split(os.path.abspath(args.dst_xunit_file))
+    compress = dst_name.endswith('.gz')
+    if compress:
+        dst_name = dst_name[:-len('.gz')]
+    destination = XunitDestination(dst_dir, compress=compress)
+    spans = []
+    destination.stream_reports(
+        os.path.splitext(dst_name)[0], args.suite_name,
+        iter_merged_reports(args.src_xunit_files, jobs=args.jobs, spans=spans),
+        package_name=args.package_name, spans=spans,
+    )
+
+
+if __name__ == "__main__":
+    main()
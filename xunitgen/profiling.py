@@ -0,0 +1,104 @@
+"""measure the resources used by recorded steps
+
+the measurements are attached to the step's report as <properties>,
+and the largest allocations as <system-out>, both shown by Jenkins'
+JUnit plugin (although outside of the strict xunit schema).
+
+Process wide counters are used: when steps overlap, as with a
+ConcurrentRecorder, each step also accounts for its neighbours.
+"""
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import sys
+
+
+def _maxrss_bytes(usage):
+    # ru_maxrss is in kilobytes, except on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def _read_proc_io():
+    """the /proc/self/io counters, or None where unavailable"""
+    try:
+        with open('/proc/self/io') as inf:
+            return dict(
+                (key, int(value)) for key, value in
+                (line.split(':') for line in inf)
+            )
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class StepProfiler(object):
+    """measures CPU time, peak RSS growth and I/O of each step
+
+    with tracemalloc_top > 0, tracemalloc is also run during the steps
+    and the allocation sites which grew the most are reported. Tracing
+    lasts until the last of the overlapping steps ends, unless it was
+    already started by someone else.
+    """
+
+    def __init__(self, tracemalloc_top=0):
+        self.tracemalloc_top = tracemalloc_top
+        self.lock = threading.Lock()
+        self.tracing_steps = 0
+        self.started_tracing = False
+
+    def start(self):
+        """take the measurements at the start of a step"""
+        snapshot = None
+        if self.tracemalloc_top > 0:
+            with self.lock:
+                if self.tracing_steps == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self.started_tracing = True
+                self.tracing_steps += 1
+            snapshot = tracemalloc.take_snapshot()
+
+        return dict(
+            cpu=time.process_time(),
+            usage=resource.getrusage(resource.RUSAGE_SELF) if resource else None,
+            io=_read_proc_io(),
+            snapshot=snapshot,
+        )
+
+    def stop(self, start, report):
+        """attach what was used since start() to the report"""
+        properties = [
+            ('cpu_time', '%f' % (time.process_time() - start['cpu'])),
+        ]
+
+        if start['usage'] is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            properties.extend([
+                ('peak_rss_delta_bytes',
+                 _maxrss_bytes(usage) - _maxrss_bytes(start['usage'])),
+                ('block_input_ops', usage.ru_inblock - start['usage'].ru_inblock),
+                ('block_output_ops', usage.ru_oublock - start['usage'].ru_oublock),
+            ])
+
+        io = _read_proc_io()
+        if io is not None and start['io'] is not None:
+            for key in ['rchar', 'wchar', 'read_bytes', 'write_bytes']:
+                if key in io and key in start['io']:
+                    properties.append(('io_%s' % key, io[key] - start['io'][key]))
+
+        if start['snapshot'] is not None:
+            stats = tracemalloc.take_snapshot().compare_to(start['snapshot'], 'lineno')
+            with self.lock:
+                self.tracing_steps -= 1
+                if self.tracing_steps == 0 and self.started_tracing:
+                    tracemalloc.stop()
+                    self.started_tracing = False
+            report.system_out = '\n'.join(
+                ['top allocations:'] + ['%s' % stat for stat in stats[:self.tracemalloc_top]]
+            )
+
+        report.properties = (report.properties or []) + properties
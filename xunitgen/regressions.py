@@ -0,0 +1,241 @@
+"""flag test cases which got slower than their history
+
+the durations of previous runs are indexed by (classname, name), from
+baseline xunit files or from a summary saved by DurationHistory. A test
+case is a regression when its duration exceeds every configured budget:
+
+- max_ratio: that many times its median duration
+- max_increase_ns: its median duration plus that many nanoseconds
+- percentile: that percentile of its past durations
+
+Regressions are recorded as failures of their reports, so that they show
+up in the xunit files written afterwards.
+"""
+from argparse import ArgumentParser
+
+import json
+import os
+import sys
+
+from .main import format_seconds
+from .merging import iter_xunit_reports, load_xunit_reports
+
+VERSION = 1
+
+
+def report_key(report):
+    return report.src_location or '', report.name
+
+
+def percentile_of(sorted_values, percentile):
+    """nearest-rank percentile of a sorted list"""
+    rank = -(-percentile * len(sorted_values) // 100)
+    return sorted_values[max(int(rank), 1) - 1]
+
+
+class DurationHistory(object):
+    """past durations in nanoseconds, by (classname, name)
+
+    only the last max_samples durations of each test case are kept.
+    """
+
+    def __init__(self, max_samples=20):
+        self.max_samples = max_samples
+        self.durations = {}
+
+    def add(self, report):
+        durations = self.durations.setdefault(report_key(report), [])
+        durations.append(report.duration_ns)
+        del durations[:-self.max_samples]
+
+    def add_xunit_file(self, path):
+        for report in iter_xunit_reports(path):
+            self.add(report)
+
+    def load_summary(self, path):
+        with open(path) as inf:
+            summary = json.load(inf)
+        if summary.get('version') != VERSION:
+            raise ValueError('%s: unsupported duration summary' % path)
+        for classname, name, durations in summary['durations']:
+            samples = self.durations.setdefault((classname, name), [])
+            samples.extend(durations)
+            del samples[:-self.max_samples]
+
+    def save_summary(self, path):
+        with open(path, 'w') as outf:
+            json.dump(dict(
+                version=VERSION,
+                durations=[
+                    [classname, name, durations]
+                    for (classname, name), durations in sorted(self.durations.items())
+                ],
+            ), outf)
+
+    def load(self, path):
+        """add a baseline xunit file, or a .json summary"""
+        if path.endswith('.json'):
+            self.load_summary(path)
+        else:
+            self.add_xunit_file(path)
+
+    def get(self, report):
+        return self.durations.get(report_key(report))
+
+
+class RegressionChecker(object):
+    """compares reports to a DurationHistory, see the module documentation
+
+    summaries holds one performance budget summary per suite checked.
+    """
+
+    def __init__(self, history, max_ratio=None, max_increase_ns=None,
+                 percentile=None, min_samples=1):
+        if max_ratio is None and max_increase_ns is None and percentile is None:
+            raise ValueError('at least one duration budget is required')
+        self.history = history
+        self.max_ratio = max_ratio
+        self.max_increase_ns = max_increase_ns
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.summaries = {}
+
+    def budget_ns(self, durations):
+        """the longest acceptable duration given past durations"""
+        durations = sorted(durations)
+        median = percentile_of(durations, 50)
+        budgets = []
+        if self.max_ratio is not None:
+            budgets.append(int(median * self.max_ratio))
+        if self.max_increase_ns is not None:
+            budgets.append(median + self.max_increase_ns)
+        if self.percentile is not None:
+            budgets.append(percentile_of(durations, self.percentile))
+        return median, max(budgets)
+
+    def check(self, suite_name, report):
+        """mark the report as failed if it exceeds its budget, returns
+        whether it did"""
+        summary = self.summaries.get(suite_name)
+        if summary is None:
+            summary = self.summaries[suite_name] = dict(
+                tests=0, unknown=0, regressions=0,
+                duration_ns=0, baseline_ns=0, budget_ns=0,
+            )
+        summary['tests'] += 1
+
+        durations = self.history.get(report)
+        if durations is None or len(durations) < self.min_samples:
+            summary['unknown'] += 1
+            return False
+
+        median, budget = self.budget_ns(durations)
+        duration = report.duration_ns
+        summary['duration_ns'] += duration
+        summary['baseline_ns'] += median
+        summary['budget_ns'] += budget
+        if duration <= budget:
+            return False
+
+        summary['regressions'] += 1
+        report.failures.append(
+            'took %ss, over its budget of %ss (median of %d runs: %ss)' % (
+                format_seconds(duration), format_seconds(budget),
+                len(durations), format_seconds(median),
+            ))
+        return True
+
+    def check_reports(self, suite_name, reports):
+        """check reports one at a time, yielding them"""
+        for report in reports:
+            self.check(suite_name, report)
+            yield report
+
+    def format_summaries(self):
+        lines = []
+        for suite_name, s in sorted(self.summaries.items()):
+            lines.append(
+                '%s: %d/%d tests over budget, %d without history, '
+                '%ss spent for a baseline of %ss and a budget of %ss' % (
+                    suite_name, s['regressions'], s['tests'], s['unknown'],
+                    format_seconds(s['duration_ns'], 3),
+                    format_seconds(s['baseline_ns'], 3),
+                    format_seconds(s['budget_ns'], 3),
+                ))
+        return '\n'.join(lines)
+
+
+def add_arguments(parser):
+    """command line options to build a RegressionChecker"""
+    parser.add_argument(
+        "--baseline", action="append", default=[], metavar="PATH",
+        help="xunit file or duration summary (.json) of previous runs, "
+        "may be repeated",
+    )
+    parser.add_argument(
+        "--max-ratio", type=float, default=None,
+        help="fail test cases taking more than that many times their median",
+    )
+    parser.add_argument(
+        "--max-increase", type=float, default=None, metavar="SECONDS",
+        help="fail test cases taking that much longer than their median",
+    )
+    parser.add_argument(
+        "--percentile", type=float, default=None,
+        help="fail test cases slower than that percentile of their history",
+    )
+
+
+def checker_from_arguments(args, history):
+    """the RegressionChecker asked for on the command line, or None"""
+    max_increase_ns = None
+    if args.max_increase is not None:
+        max_increase_ns = int(args.max_increase * 1e9)
+    if args.max_ratio is None and max_increase_ns is None and args.percentile is None:
+        return None
+    return RegressionChecker(
+        history, max_ratio=args.max_ratio, max_increase_ns=max_increase_ns,
+        percentile=args.percentile,
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description="add xunit files to a duration summary, checking them "
+        "first when budgets are given",
+    )
+    parser.add_argument(
+        "dst_summary", help="duration summary (.json) to create or update",
+    )
+    parser.add_argument("src_xunit_files", nargs="+")
+    parser.add_argument(
+        "--max-samples", type=int, default=20,
+        help="number of past durations kept for each test case",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    history = DurationHistory(max_samples=args.max_samples)
+    if os.path.exists(args.dst_summary):
+        history.load_summary(args.dst_summary)
+    for path in args.baseline:
+        history.load(path)
+    checker = checker_from_arguments(args, history)
+
+    for path in args.src_xunit_files:
+        reports = load_xunit_reports(path)
+        if checker is not None:
+            for report in reports:
+                checker.check(path, report)
+        for report in reports:
+            history.add(report)
+
+    history.save_summary(args.dst_summary)
+    if checker is not None:
+        sys.stdout.write(checker.format_summaries() + '\n')
+        if any(s['regressions'] for s in checker.summaries.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
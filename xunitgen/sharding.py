@@ -0,0 +1,231 @@
+"""split test cases into shards of similar durations
+
+the duration of each test case, by (classname, name), is estimated from
+the xunit files of previous runs with an exponentially weighted moving
+average, so that recent runs count the most. Test cases are then spread
+over N shards with the longest processing time first heuristic: the
+longest test case goes to the least loaded shard, and so on.
+
+Once the shards have run, their xunit files tell how far the predicted
+makespan (the duration of the slowest shard) was from the actual one.
+"""
+from argparse import ArgumentParser
+
+import heapq
+import json
+import os
+import sys
+
+from .main import NANOS_PER_SECOND, format_seconds
+from .merging import iter_xunit_reports
+from .regressions import report_key
+
+VERSION = 1
+
+
+class DurationEstimates(object):
+    """estimated durations in nanoseconds, by (classname, name)
+
+    each new duration d moves the estimate e to alpha * d + (1 - alpha) * e
+    """
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.estimates = {}
+
+    def add(self, report):
+        key = report_key(report)
+        estimate = self.estimates.get(key)
+        duration = report.duration_ns
+        if estimate is not None:
+            duration = int(self.alpha * duration + (1 - self.alpha) * estimate)
+        self.estimates[key] = duration
+
+    def add_xunit_file(self, path):
+        for report in iter_xunit_reports(path):
+            self.add(report)
+
+    def load(self, path):
+        with open(path) as inf:
+            state = json.load(inf)
+        if state.get('version') != VERSION:
+            raise ValueError('%s: unsupported duration estimates' % path)
+        for classname, name, estimate in state['estimates']:
+            self.estimates[(classname, name)] = estimate
+
+    def save(self, path):
+        with open(path, 'w') as outf:
+            json.dump(dict(
+                version=VERSION,
+                estimates=[
+                    [classname, name, estimate]
+                    for (classname, name), estimate in sorted(self.estimates.items())
+                ],
+            ), outf)
+
+    def default_ns(self):
+        """the estimate of unknown test cases: the mean of all estimates"""
+        if not self.estimates:
+            return NANOS_PER_SECOND
+        return sum(self.estimates.values()) // len(self.estimates)
+
+    def get(self, key, default_ns=None):
+        estimate = self.estimates.get(key)
+        if estimate is None:
+            return self.default_ns() if default_ns is None else default_ns
+        return estimate
+
+
+def plan_shards(tests, shard_count, estimates):
+    """spread (classname, name) test keys over shard_count shards
+
+    returns a list of shards, as dicts of their index, tests and
+    predicted duration.
+    """
+    if shard_count < 1:
+        raise ValueError('there must be at least one shard')
+
+    default_ns = estimates.default_ns()
+    weighted = sorted(
+        ((estimates.get(key, default_ns), key) for key in set(tests)),
+        key=lambda item: (-item[0], item[1]),
+    )
+
+    shards = [dict(index=i, tests=[], predicted_ns=0) for i in range(shard_count)]
+    loads = [(0, i) for i in range(shard_count)]
+    for estimate, key in weighted:
+        load, index = heapq.heappop(loads)
+        shards[index]['tests'].append(list(key))
+        shards[index]['predicted_ns'] += estimate
+        heapq.heappush(loads, (load + estimate, index))
+    return shards
+
+
+def makespan_ns(shards):
+    return max(shard['predicted_ns'] for shard in shards)
+
+
+def compare_makespan(shards, shard_reports):
+    """the predicted against the actual durations of the shards
+
+    shard_reports holds the reports of each shard, in order. Shards are
+    assumed to run their test cases one after the other.
+    """
+    actual = [sum(r.duration_ns for r in reports) for reports in shard_reports]
+    return dict(
+        predicted_makespan_ns=makespan_ns(shards),
+        actual_makespan_ns=max(actual) if actual else 0,
+        shards=[
+            dict(index=shard['index'], predicted_ns=shard['predicted_ns'],
+                 actual_ns=actual_ns)
+            for shard, actual_ns in zip(shards, actual)
+        ],
+    )
+
+
+def write_plan(shards, outf):
+    json.dump(dict(
+        version=VERSION,
+        predicted_makespan_ns=makespan_ns(shards),
+        shards=shards,
+    ), outf, indent=2)
+
+
+def read_plan(path):
+    with open(path) as inf:
+        plan = json.load(inf)
+    if plan.get('version') != VERSION:
+        raise ValueError('%s: unsupported shard plan' % path)
+    return plan['shards']
+
+
+def read_test_list(path):
+    """(classname, name) keys from a file of 'classname<TAB>name' lines"""
+    tests = []
+    with open(path) as inf:
+        for lineno, line in enumerate(inf, 1):
+            if not line.strip():
+                continue
+            key = tuple(line.rstrip('\n').split('\t', 1))
+            if len(key) != 2:
+                raise ValueError(
+                    "%s:%d: expected 'classname<TAB>name', got %r" % (path, lineno, line))
+            tests.append(key)
+    return tests
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser(
+        'update', help='update duration estimates from xunit files')
+    update.add_argument("estimates", help="estimates file (.json), created if missing")
+    update.add_argument("src_xunit_files", nargs="+")
+    update.add_argument("--alpha", type=float, default=0.3,
+                        help="weight of the newest durations")
+
+    plan = commands.add_parser('plan', help='write a shard plan')
+    plan.add_argument("estimates")
+    plan.add_argument("shard_count", type=int)
+    plan.add_argument(
+        "--tests", metavar="PATH",
+        help="test cases to shard, as 'classname<TAB>name' lines. "
+        "All the test cases with an estimate by default",
+    )
+    plan.add_argument("--output", "-o", metavar="PATH",
+                      help="shard plan (.json) to write, instead of stdout")
+
+    show = commands.add_parser(
+        'show', help="list the test cases of a shard, as 'classname<TAB>name' lines")
+    show.add_argument("plan")
+    show.add_argument("shard", type=int)
+
+    compare = commands.add_parser(
+        'compare', help='compare the predicted and actual makespans')
+    compare.add_argument("plan")
+    compare.add_argument("shard_xunit_files", nargs="+",
+                         help="the xunit file of each shard, in order")
+
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        estimates = DurationEstimates(alpha=args.alpha)
+        if os.path.exists(args.estimates):
+            estimates.load(args.estimates)
+        for path in args.src_xunit_files:
+            estimates.add_xunit_file(path)
+        estimates.save(args.estimates)
+
+    elif args.command == 'plan':
+        estimates = DurationEstimates()
+        estimates.load(args.estimates)
+        tests = read_test_list(args.tests) if args.tests else list(estimates.estimates)
+        shards = plan_shards(tests, args.shard_count, estimates)
+        if args.output:
+            with open(args.output, 'w') as outf:
+                write_plan(shards, outf)
+        else:
+            write_plan(shards, sys.stdout)
+
+    elif args.command == 'show':
+        for classname, name in read_plan(args.plan)[args.shard]['tests']:
+            sys.stdout.write('%s\t%s\n' % (classname, name))
+
+    elif args.command == 'compare':
+        shards = read_plan(args.plan)
+        if len(shards) != len(args.shard_xunit_files):
+            parser.error('expected the xunit files of %d shards' % len(shards))
+        comparison = compare_makespan(
+            shards, [list(iter_xunit_reports(path)) for path in args.shard_xunit_files])
+        for shard in comparison['shards']:
+            sys.stdout.write('shard %d: predicted %ss, actual %ss\n' % (
+                shard['index'], format_seconds(shard['predicted_ns'], 3),
+                format_seconds(shard['actual_ns'], 3)))
+        sys.stdout.write('makespan: predicted %ss, actual %ss\n' % (
+            format_seconds(comparison['predicted_makespan_ns'], 3),
+            format_seconds(comparison['actual_makespan_ns'], 3)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
+import asyncio
+import contextvars
 import sys
-import time
+import threading
+import traceback
 
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 
-from .main import EventReceiver
+from .main import EventReceiver, NANOS_PER_SECOND, clock_ns
 
 class Recorder(object):
     """Use this class to record the result of running python code as a xunit xml
 
     It allows you to record a series of steps into a single xunit.xml file.
 
+    Exceptions escaping a step are recorded as their type, message and
+    the place they were raised at, or as a full traceback with
+    full_tracebacks set.
     """
 
-    def __init__(self, xunit_destination, name, package_name=None):
+    def __init__(self, xunit_destination, name, package_name=None,
+                 profiler=None, full_tracebacks=False):
         self.name = name
         self.package_name = package_name
         self.destination = xunit_destination
         self.event_receiver = None
+        # optional profiling.StepProfiler
+        self.profiler = profiler
+        self.full_tracebacks = full_tracebacks
 
 
     def __enter__(self):
@@ -24,8 +35,25 @@ class Recorder(object):
         return self
 
 
+    def now_ns(self):
+        """high resolution timestamp of step boundaries, see main.clock_ns"""
+        return clock_ns()
+
+
     def now_seconds(self):
-        return time.time()
+        return self.now_ns() / float(NANOS_PER_SECOND)
+
+
+    def exception_message(self, etype, evalue, tb):
+        if self.full_tracebacks:
+            return ''.join(traceback.format_exception(etype, evalue, tb)).rstrip('\n')
+
+        message = traceback.format_exception_only(etype, evalue)[-1].rstrip('\n')
+        if tb is None:
+            return message
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        return '%s (at %s:%d)' % (message, tb.tb_frame.f_code.co_filename, tb.tb_lineno)
 
 
     def step(self, step_name):
@@ -37,21 +65,27 @@ class Recorder(object):
             if self.event_receiver.current_case is not None:
                 raise Exception('cannot open a step within a step')
 
-            self.event_receiver.begin_case(step_name, self.now_seconds(), self.name)
+            self.event_receiver.begin_case_ns(step_name, self.now_ns(), self.name)
+            profile = self.profiler.start() if self.profiler else None
             try:
                 yield self.event_receiver
             except:
-                etype, evalue, tb = sys.exc_info()
-                self.event_receiver.error('%r' % [etype, evalue, tb])
+                self.event_receiver.error(self.exception_message(*sys.exc_info()))
                 raise
             finally:
-                self.event_receiver.end_case(step_name, self.now_seconds())
+                if profile is not None:
+                    self.profiler.stop(profile, self.event_receiver.current_case)
+                self.event_receiver.end_case_ns(step_name, self.now_ns())
 
         return step_context(step_name)
 
 
+    def results(self):
+        return self.event_receiver.results()
+
+
     def __exit__(self, *exc_info):
-        results = self.event_receiver.results()
+        results = self.results()
         if not results:
             already_throwing = exc_info and exc_info[0] is not None
             if not already_throwing:
@@ -60,3 +94,129 @@ class Recorder(object):
         self.destination.write_reports(
             self.name, self.name, results, package_name=self.package_name,
         )
+
+
+class ConcurrentRecorder(Recorder):
+    """A Recorder whose steps may run at the same time, from many threads
+
+    Every step records into its own EventReceiver, which is what the
+    step context manager yields. Steps still cannot be nested within a
+    thread.
+    """
+
+    def __init__(self, xunit_destination, name, package_name=None,
+                 profiler=None, full_tracebacks=False):
+        super(ConcurrentRecorder, self).__init__(
+            xunit_destination, name, package_name=package_name,
+            profiler=profiler, full_tracebacks=full_tracebacks,
+        )
+        self.lock = threading.Lock()
+        self.reports = None
+        self.current_step = contextvars.ContextVar('current_step', default=None)
+
+
+    def __enter__(self):
+        self.reports = []
+        return self
+
+
+    def begin_step(self, step_name):
+        if self.reports is None:
+            raise Exception('steps must be recorded within the recorder context')
+        if self.current_step.get() is not None:
+            raise Exception('cannot open a step within a step')
+
+        event_receiver = EventReceiver()
+        event_receiver.begin_case_ns(step_name, self.now_ns(), self.name)
+        profile = self.profiler.start() if self.profiler else None
+        return event_receiver, (self.current_step.set(step_name), profile)
+
+
+    def end_step(self, step_name, event_receiver, token):
+        token, profile = token
+        self.current_step.reset(token)
+        if profile is not None:
+            self.profiler.stop(profile, event_receiver.current_case)
+        event_receiver.end_case_ns(step_name, self.now_ns())
+        with self.lock:
+            self.reports.extend(event_receiver.results())
+
+
+    def step(self, step_name):
+        """Start a new step. returns a context manager which allows you to
+        report an error"""
+
+        @contextmanager
+        def step_context(step_name):
+            event_receiver, token = self.begin_step(step_name)
+            try:
+                yield event_receiver
+            except:
+                event_receiver.error(self.exception_message(*sys.exc_info()))
+                raise
+            finally:
+                self.end_step(step_name, event_receiver, token)
+
+        return step_context(step_name)
+
+
+    def run_steps(self, steps, max_workers=None):
+        """run (step_name, callable) pairs as steps on a thread pool
+
+        each callable receives its step. Returns the list of their
+        results, in order. All steps are run to completion even when some
+        raise; the first exception is then re-raised.
+        """
+
+        def run_step(step_name, fn):
+            with self.step(step_name) as step:
+                return fn(step)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(run_step, step_name, fn)
+                for step_name, fn in steps
+            ]
+
+        return [future.result() for future in futures]
+
+
+    def results(self):
+        with self.lock:
+            return sorted(self.reports, key=lambda r: r.start_ns)
+
+
+class AsyncRecorder(ConcurrentRecorder):
+    """A Recorder for asyncio code, used with `async with`
+
+    Steps are async context managers and may overlap freely on the event
+    loop, for instance when gathering many coroutines. Each task tracks
+    its own current step. The reports are written from an executor so
+    that the loop is not blocked.
+    """
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+
+    def step(self, step_name):
+        """Start a new step. returns an async context manager which allows
+        you to report an error"""
+
+        @asynccontextmanager
+        async def step_context(step_name):
+            event_receiver, token = self.begin_step(step_name)
+            try:
+                yield event_receiver
+            except:
+                event_receiver.error(self.exception_message(*sys.exc_info()))
+                raise
+            finally:
+                self.end_step(step_name, event_receiver, token)
+
+        return step_context(step_name)
+
+
+    async def __aexit__(self, *exc_info):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: self.__exit__(*exc_info))